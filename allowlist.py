@@ -0,0 +1,132 @@
+import socket
+import struct
+import threading
+import time
+
+from app import app
+
+__all__ = [
+    'Allowlist',
+]
+
+
+def parse_address(addr):
+    """Return (family, address as an integer) of an IPv4 or IPv6
+    address, or None if it is neither
+
+    :param addr:
+        The address in text
+    """
+    for family, size in [(socket.AF_INET, 4), (socket.AF_INET6, 16)]:
+        try:
+            packed = socket.inet_pton(family, addr)
+        except (socket.error, ValueError):
+            continue
+        high, low = struct.unpack('!QQ', packed.rjust(16, '\0'))
+        return family, (high << 64) | low, size * 8
+    return None
+
+
+class Allowlist(object):
+    """A set of remote addresses allowed, given by host names, addresses
+    and CIDR ranges
+
+    Host names are resolved to all their A/AAAA records by a background
+    thread on an interval, so checking an address never waits for DNS.
+    If a host fails to resolve, its last good addresses are kept, and
+    the host names are resolved again after the shorter retry.
+
+    :param entries:
+        A list of host names, addresses and CIDR ranges such as
+        10.0.0.0/8
+    :param interval:
+        The seconds between resolutions of the host names
+    :param retry:
+        The seconds until the host names are resolved again after a
+        failure
+    """
+    def __init__(self, entries, interval=300, retry=30):
+        self.interval = interval
+        self.retry = min(retry, interval)
+        self.hosts = []
+        # (family, network, prefix length) of addresses and ranges
+        self.networks = []
+        for entry in entries:
+            addr, _, prefix = entry.partition('/')
+            parsed = parse_address(addr)
+            if parsed is None:
+                self.hosts.append(entry)
+                continue
+            family, value, bits = parsed
+            prefix = int(prefix) if prefix else bits
+            self.networks.append(
+                (family, value >> (bits - prefix), bits - prefix))
+
+        # host -> the set of (family, address) it resolves to
+        self._resolved = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def resolve(self, host):
+        """Return the set of (family, address) a host resolves to"""
+        result = set()
+        for family, _, _, _, sockaddr in socket.getaddrinfo(host, None):
+            parsed = parse_address(sockaddr[0])
+            if parsed is not None:
+                result.add(parsed[:2])
+        return result
+
+    def refresh(self):
+        """Resolve the host names again
+
+        Return whether all of them are resolved
+        """
+        success = True
+        for host in self.hosts:
+            try:
+                addresses = self.resolve(host)
+            except socket.error:
+                app.logger.warning('Failed to resolve %s', host)
+                success = False
+                continue
+            if addresses:
+                with self._lock:
+                    self._resolved[host] = addresses
+            else:
+                success = False
+        return success
+
+    def _run(self, success):
+        while True:
+            time.sleep(self.interval if success else self.retry)
+            success = self.refresh()
+
+    def start(self):
+        """Resolve the host names now and then in a background thread"""
+        success = self.refresh()
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(success,))
+            self._thread.daemon = True
+        self._thread.start()
+
+    def allows(self, addr):
+        """Return whether a remote address is allowed
+
+        :param addr:
+            The address in text
+        """
+        if self._thread is None:
+            self.start()
+        parsed = parse_address(addr or '')
+        if parsed is None:
+            return False
+        family, value, bits = parsed
+        for net_family, network, shift in self.networks:
+            if net_family == family and value >> shift == network:
+                return True
+        with self._lock:
+            return any(
+                (family, value) in x for x in self._resolved.values())
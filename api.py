@@ -1,19 +1,24 @@
-import uuid
-from datetime import datetime, timedelta
+import math
+from datetime import datetime, timedelta, MINYEAR, MAXYEAR
 
 from flask import g, jsonify, render_template, request, json, Response
 from peewee import DoesNotExist, fn
 from flask_peewee.rest import Authentication
-from flask_peewee.utils import get_object_or_404
 
-from app import app
+import flask_cas
+from app import app, db
 from auth import auth
 from models import *
 from forms import *
 from helpers import query_user, upload_file, send_email, \
-                    update_mailing_list
+                    update_mailing_list, spool_upload
+from db_ext import IntegrityError
+from thumbnail import submit_variants, wants_variants
 from frame_ext import JSONRestAPI, HookedResource, BusinessException, \
-                        BaseAuthentication, AdminAuthentication
+                        BaseAuthentication, AdminAuthentication, \
+                        merge_ordered
+from cache_ext import object_cache, model_changed, RandomPool
+from catalogue import catalogue
 
 __all__ = [
     'api',
@@ -33,6 +38,40 @@ class LoggedRestResource(HookedResource):
     """
     log_model = None
 
+    # names of models in Log whose changes show in the resource, default
+    # to log_model
+    version_logs = None
+
+    @classmethod
+    def get_version_logs(cls):
+        """Return the names of models in Log whose changes show in the
+        resource, together with those of the resources included. Files
+        are logged when their variants are made.
+        """
+        models = set(cls.version_logs or [cls.log_model])
+        for resource in (cls.include_resources or {}).values():
+            if resource is FileResource:
+                models.add('File')
+            elif issubclass(resource, LoggedRestResource):
+                models.update(resource.get_version_logs())
+        return sorted(models)
+
+    def get_version(self):
+        """Derive the version from the latest log of the resource
+
+        MAX(id) of a single model is read from the end of the index on
+        model, which InnoDB extends with the primary key. Only the
+        latest log is then looked up for its time.
+        """
+        models = self.get_version_logs()
+        last_id = max([Log.select(fn.Max(Log.id)).where(
+            Log.model == x).scalar() for x in models])
+        if last_id is None:
+            return str(last_id), None
+        last_time = Log.select(Log.created_at).where(
+            Log.id == last_id).scalar(convert=True)
+        return str(last_id), last_time
+
     def get_log(self, instance, id):
         """Return the log content of the operation
 
@@ -86,6 +125,8 @@ class FileResource(HookedResource):
 
     The file upload will not be logged in the system
     """
+    serialize_tuples = True
+
     def check_post(self, obj=None):
         """Edition not allowed through API"""
         return obj is None
@@ -101,8 +142,10 @@ class FileResource(HookedResource):
     def create(self):
         """Create file on upload
 
-        The file will be relayed to FTP server
-        The server only keeps a record of the file
+        The file will be relayed to FTP server, stored under the digest
+        of its content. The server only keeps a record of the file.
+        Content uploaded before is not stored again, and the existing
+        record is returned.
         """
         # The file uploaded
         file = request.files['file']
@@ -110,19 +153,40 @@ class FileResource(HookedResource):
         # extract the extension
         ext = ('.' + name.rsplit('.', 1)[1]) if '.' in name else ''
 
-        # Generate a unique random filename
-        new_filename = str(uuid.uuid4()) + ext
-        while File.select().where(File.url == new_filename).count() > 0:
-            new_filename = str(uuid.uuid4()) + ext
+        digest, content = spool_upload(file.stream)
+        try:
+            # the same content may come with another extension
+            instance = File.select().where(File.url % (digest + '%')).get()
+            content.close()
+            return self.object_detail(instance)
+        except DoesNotExist:
+            pass
 
         # upload to FTP server
+        new_filename = digest + ext
+        data = None
         try:
-            upload_file(new_filename, file)
+            upload_file(new_filename, content)
+            # only images are read whole, for their variants
+            if wants_variants(new_filename):
+                content.seek(0)
+                data = content.read()
         except Exception:
             return jsonify(errno=500, error="Upload failed")
+        finally:
+            content.close()
 
         # save record
-        instance = File.create(name=name, url=new_filename)
+        try:
+            instance = File.create(name=name, url=new_filename)
+        except IntegrityError:
+            # uploaded by another request at the same time
+            instance = File.select().where(File.url == new_filename).get()
+            return self.object_detail(instance)
+
+        # smaller copies of images, made without waiting
+        if data is not None:
+            submit_variants(instance, data)
         return self.object_detail(instance)
 
 
@@ -133,7 +197,8 @@ class UserResource(HookedResource):
     # These fields are handled by system
     readonly = [
                 'join_at', 'last_login',
-                'this_login', 'login_count', 'rfs_count'
+                'this_login', 'login_count', 'rfs_count',
+                'borrowed_cnt', 'reserved_cnt',
                 ]
     search = {
         'default': ['full_name', 'student_id', 'itsc']
@@ -161,7 +226,7 @@ class UserResource(HookedResource):
             Log.log_type == 'borrow',
             Log.model == 'Disk',
             Log.user_affected == obj,
-            Log.content % "check out%").group_by(Log.model_refer).limit(10)
+            Log.sub_type == 'checkout').group_by(Log.model_refer).limit(10)
         data['borrow_history'] = map(self.disk_wrapper,
                                         (x.model_refer for x in history_sq))
         return super(UserResource, self).prepare_data(obj, data)
@@ -326,9 +391,135 @@ class LogResource(HookedResource):
         'admin_involved': SimpleUserResource,
     }
 
+    # the order of merged pages without ?ordering=, as Log.Meta
+    cursor_ordering = ('-created_at',)
+
     def check_get(self, obj=None):
         return g.user and g.user.admin
 
+    def get_created_range(self):
+        """Return (lower, upper) of created_at the request asks for, each
+        None if unbounded. ?year= asks for the whole year.
+        """
+        year = request.args.get('year', '')
+        if year.isdigit():
+            year = int(year)
+            if not MINYEAR <= year < MAXYEAR:
+                raise BusinessException(
+                    "Invalid year", self.response_bad_request())
+            return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+        def parse(bound):
+            try:
+                return datetime.strptime((bound or '')[:10], '%Y-%m-%d')
+            except ValueError:
+                return None
+        return (parse(request.args.get('created_at__gt') or
+                        request.args.get('created_at__gte')),
+                parse(request.args.get('created_at__lt') or
+                        request.args.get('created_at__lte')))
+
+    def get_log_models(self):
+        """Return the models of logs the request reaches: Log, and the
+        archives of the years overlapping the range asked for. Logs of
+        kept types and logs not archived yet are in Log at any age.
+        """
+        lower, upper = self.get_created_range()
+        years = archive_years_between(log_archive_years(), lower, upper)
+        return [Log] + [get_log_archive(x) for x in years]
+
+    def restrict_year(self, query):
+        """Keep the logs of ?year= only"""
+        year = request.args.get('year', '')
+        if not year.isdigit():
+            return query
+        lower, upper = self.get_created_range()
+        model = query.model_class
+        return query.where(
+            model.created_at >= lower, model.created_at < upper)
+
+    def order_query(self, query):
+        """Order a query the way merged pages are ordered"""
+        return query.order_by(*[x.desc() if desc else x.asc() for x, desc
+                        in self.get_cursor_ordering(query.model_class)])
+
+    def object_list(self):
+        return self.merged_object_list(
+            lambda x: self.process_query(self.apply_ordering(x)))
+
+    def search_object_list(self):
+        return self.merged_object_list(
+            lambda x: self.apply_search(self.apply_ordering(x)))
+
+    def merged_object_list(self, build):
+        """Return the list of logs from Log and the archives reached,
+        merged in order
+
+        :param build:
+            A function applying the filters of the request to a query
+        """
+        queries = [self.restrict_year(build(x.select()))
+                    for x in self.get_log_models()]
+        if len(queries) == 1:
+            return self.paginated_object_list(queries[0])
+
+        ordering = [(x.name, desc)
+                    for x, desc in self.get_cursor_ordering(Log)]
+        size = self.get_page_size()
+        if 'cursor' in request.args:
+            return self.merged_cursor_list(queries, ordering, size)
+
+        # the rows of a page are within the first page * size rows of
+        # each table
+        page = request.args.get('page', '')
+        page = int(page) if page.isdigit() and int(page) > 0 else 1
+        objects = merge_ordered(
+            [self.order_query(x).limit(page * size) for x in queries],
+            ordering, page * size)[(page - 1) * size:]
+        total = sum(x.count() for x in queries)
+        pages = int(math.ceil(total / float(size)))
+        return self.stream_response(
+            self.get_page_metadata(page, pages), objects)
+
+    def merged_cursor_list(self, queries, ordering, size):
+        """Return the cursor page of logs merged from queries
+
+        :param queries:
+            The filtered queries of Log and the archives
+        :param ordering:
+            A list of (name of field, descending) of the merged list
+        :param size:
+            The number of logs on the page
+        """
+        cursor = request.args.get('cursor')
+        lists = []
+        for query in queries:
+            query = self.order_query(query)
+            if cursor:
+                model_ordering = self.get_cursor_ordering(query.model_class)
+                query = query.where(self.keyset_predicate(
+                    model_ordering,
+                    self.decode_cursor(cursor, model_ordering)))
+            # fetch one more to know whether there is a next page
+            lists.append(query.limit(size + 1))
+        objects = merge_ordered(lists, ordering, size + 1)
+
+        next = ''
+        if len(objects) > size:
+            objects = objects[:size]
+            request_arguments = request.args.copy()
+            request_arguments['cursor'] = self.encode_cursor(
+                objects[-1], self.get_cursor_ordering(Log))
+            next = self.get_list_url(request_arguments)
+
+        totals = [self.get_total(x) for x in queries]
+        return self.stream_response({
+            'model': self.get_api_name(),
+            'cursor': cursor or '',
+            'total': None if None in totals else sum(totals),
+            'next': next,
+        }, objects)
+
 
 class SimpleLogResource(HookedResource):
     """For those only need create date and time"""
@@ -343,6 +534,15 @@ class DiskResource(LoggedRestResource):
     log_model = "Disk"
     validate_form = DiskForm
 
+    # availability of disks changes with shows, holders with members
+    version_logs = ['Disk', 'RegularFilmShow', 'User']
+    # disks held by the member are flagged
+    cache_control = 'private, no-cache'
+    vary_by_user = True
+
+    # candidates of random picks
+    rand_pool = RandomPool(Disk, [Disk.disk_type << ['B']])
+
     readonly = [
         'hold_by', 'reserved_by',
         'borrow_cnt', 'rank', 'create_log'
@@ -392,6 +592,7 @@ class DiskResource(LoggedRestResource):
             ('/<pk>/rate/',
                 self.require_method(self.api_rate, ['GET', 'POST'])),
             ('/rand/', self.require_method(self.api_rand, ['GET'])),
+            ('/tags/', self.require_method(self.api_tags, ['GET'])),
         ) + super(DiskResource, self).get_urls()
 
     def get_log(self, instance, id):
@@ -405,124 +606,220 @@ class DiskResource(LoggedRestResource):
         else:
             return self.model.select().where(self.model.avail_type != "Draft")
 
+    # search engine -> (association model, field of names)
+    name_indexes = {
+        'tag': (DiskTag, DiskTag.tag),
+        'actor': (DiskActor, DiskActor.actor),
+    }
+
+    def filter_by_name(self, query, engine, name, prefix=False):
+        """Keep the disks having a tag or actor, looked up through the
+        association table
+
+        :param engine:
+            'tag' or 'actor'
+        :param name:
+            The tag or the actor
+        :param prefix:
+            Whether names starting with name match as well
+        """
+        model, field = self.name_indexes[engine]
+        cond = (field % (name.replace('%', '') + '%')) if prefix \
+            else (field == name)
+        return query.where(
+            self.model.id << model.select(model.disk).where(cond))
+
+    def process_query(self, query):
+        """Support ?tag= and ?actor= through the association tables
+        """
+        query = super(DiskResource, self).process_query(query)
+        for engine in ['tag', 'actor']:
+            for name in request.args.getlist(engine):
+                query = self.filter_by_name(query, engine, name)
+        return query
+
+    def apply_search_engine(self, query, engine, terms):
+        """Search tags and actors by prefix through their indexes
+        """
+        if engine not in self.name_indexes:
+            return super(DiskResource, self).apply_search_engine(
+                query, engine, terms)
+        for term in terms:
+            query = self.filter_by_name(query, engine, term, prefix=True)
+        return query
+
+    def api_tags(self):
+        """API of the tags and the number of disks of each, most used
+        first
+        """
+        try:
+            limit = int(request.args.get('limit', 100))
+        except ValueError:
+            limit = 100
+        sq = TagFacet.select().where(
+            TagFacet.count > 0).order_by(TagFacet.count.desc()).limit(limit)
+        return self.response({
+            'objects': [{'tag': x.tag, 'count': x.count} for x in sq],
+        })
+
+    # ordering -> mode of the catalogue answering plain list pages
+    catalogue_modes = {
+        '-borrow_cnt': 'popular',
+        '-rank': 'rank',
+        '-id': 'newest',
+    }
+
+    def paginated_object_list(self, filtered_query):
+        """Answer list pages only ordered and paginated from the
+        catalogue, without counting and sorting in the database
+        """
+        mode = self.catalogue_modes.get(request.args.get('ordering'))
+        plain = set(request.args.keys()) <= set(
+            ['ordering', 'page', 'limit', 'pretty'])
+        if g.list_callback != 'api_list' or not (mode and plain):
+            return super(DiskResource, self).paginated_object_list(
+                filtered_query)
+
+        page = request.args.get('page', '')
+        page = int(page) if page.isdigit() and int(page) > 0 else 1
+        objects, pages = catalogue.get_page(
+            mode, page, self.get_page_size(),
+            public=not (g.user and g.user.admin))
+        return self.stream_response(
+            self.get_page_metadata(page, pages), objects)
+
     def api_reserve(self, pk):
         """API to reserve a disk"""
-        obj = get_object_or_404(self.get_query(), self.pk == pk)
+        obj = self.get_object(pk, fresh=True)
         data = request.data or request.form.get('data') or ''
 
         new_log = Log(model='Disk', log_type='reserve', model_refer=obj.id)
+        mail = None
+
+        # the slot taken, the disk and the log succeed or fail together
+        with db.database.transaction():
+            if request.method == 'POST':
+                data = self.data_precheck(data, ReserveForm)
+
+                # reserve the disk
+                obj.reserve(g.user, data['form'])
+                new_log.user_affected = g.user
+                new_log.sub_type = data['form'].lower()
+
+                if data['form'] == 'Counter':
+                    new_log.content = ("member %s reserves disk"
+                                        " %s (counter)") % \
+                                        (g.user.itsc, obj.get_callnumber())
+                elif data['form'] == 'Hall':
+                    new_log.content = ("member %s reserves disk"
+                                        " %s (Hall %d %s). remarks: %s") %\
+                                        (
+                                            g.user.itsc,
+                                            obj.get_callnumber(),
+                                            data.get('hall', ''),
+                                            data.get('room', ''),
+                                            data.get('remarks', '')
+                                        )
+
+                    # email to reminder exco to deliver disk
+                    mail_content = render_template(
+                        'exco_reserve.html', disk=obj, member=g.user,
+                        data=data, time=str(datetime.now()))
+                    sq = Exco.select().where(
+                        Exco.hall_allocate % ("%%%d%%" % int(data.get('hall', '*'))))
+                    mail = (['su_film@ust.hk'] + [x.email for x in sq],
+                            mail_content)
+
+            elif request.method == 'DELETE':
+                # clear reservation
+                if not self.check_delete(obj):
+                    return self.response_forbidden()
 
-        if request.method == 'POST':
-            data = self.data_precheck(data, ReserveForm)
-
-            # reserve the disk
-            obj.reserve(g.user, data['form'])
-            new_log.user_affected = g.user
-
-            if data['form'] == 'Counter':
-                new_log.content = ("member %s reserves disk"
-                                    " %s (counter)") % \
-                                    (g.user.itsc, obj.get_callnumber())
-            elif data['form'] == 'Hall':
-                new_log.content = ("member %s reserves disk"
-                                    " %s (Hall %d %s). remarks: %s") %\
-                                    (
-                                        g.user.itsc,
-                                        obj.get_callnumber(),
-                                        data.get('hall', ''),
-                                        data.get('room', ''),
-                                        data.get('remarks', '')
-                                    )
-
-                # send email to reminder exco to deliver disk
-                mail_content = render_template(
-                    'exco_reserve.html', disk=obj, member=g.user,
-                    data=data, time=str(datetime.now()))
-                sq = Exco.select().where(
-                    Exco.hall_allocate % ("%%%d%%" % int(data.get('hall', '*'))))
-                send_email(
-                    ['su_film@ust.hk'] + [x.email for x in sq], [],
-                    "Delivery Request", mail_content)
-
-        elif request.method == 'DELETE':
-            # clear reservation
-            if not self.check_delete(obj):
-                return self.response_forbidden()
+                new_log.content = "clear reservation for disk %s" % obj.get_callnumber()
+                new_log.sub_type = 'clear'
+                new_log.admin_involved = g.user
+                new_log.user_affected = obj.reserved_by
+                obj.clear_reservation()
 
-            new_log.content = "clear reservation for disk %s" % obj.get_callnumber()
-            new_log.admin_involved = g.user
-            new_log.user_affected = obj.reserved_by
-            obj.clear_reservation()
+            obj.save()
+            new_log.save()
 
-        obj.save()
-        new_log.save()
+        # sent once the reservation is kept
+        if mail:
+            send_email(mail[0], [], "Delivery Request", mail[1])
         return self.object_detail(obj)
 
     def api_borrow(self, pk):
         """API to borrow disk"""
-        obj = get_object_or_404(self.get_query(), self.pk == pk)
+        obj = self.get_object(pk, fresh=True)
         data = request.data or request.form.get('data') or ''
 
         new_log = Log(model='Disk', log_type='borrow', model_refer=obj.id)
 
-        if request.method == 'POST':
-            data = self.data_precheck(data, SubmitUserForm)
-
-            # existence has been checked by SubmitUserForm
-            req_user = User.select().where(User.id == data['id']).get()
-            if obj.avail_type == 'Borrowed':
-                # renew
-                # only admin or holder can renew
-                if obj.hold_by != req_user:
-                    return jsonify(errno=3, error="Disk not borrowed by the user")
-                if not self.check_post(obj) and req_user != g.user:
-                    return self.response_forbidden()
+        # the slot taken, the disk and the log succeed or fail together
+        with db.database.transaction():
+            if request.method == 'POST':
+                data = self.data_precheck(data, SubmitUserForm)
+
+                # existence has been checked by SubmitUserForm
+                req_user = self.get_instance(User, int(data['id']))
+                if obj.avail_type == 'Borrowed':
+                    # renew
+                    # only admin or holder can renew
+                    if obj.hold_by != req_user:
+                        return jsonify(errno=3, error="Disk not borrowed by the user")
+                    if not self.check_post(obj) and req_user != g.user:
+                        return self.response_forbidden()
                 
-                # renew it
-                obj.renew()
-                new_log.content = ("member %s renews disk %s" %
-                                (req_user.itsc, obj.get_callnumber()))
-                new_log.user_affected = req_user
-                if g.user.admin:
+                    # renew it
+                    obj.renew()
+                    new_log.content = ("member %s renews disk %s" %
+                                    (req_user.itsc, obj.get_callnumber()))
+                    new_log.sub_type = 'renew'
+                    new_log.user_affected = req_user
+                    if g.user.admin:
+                        new_log.admin_involved = g.user
+                elif obj.avail_type == 'Reserved':
+                    # taken to deliver
+                    if not self.check_post(obj):
+                        return self.response_forbidden()
+
+                    obj.deliver()
+                    new_log.content = ("take out disk %s for delivery" % 
+                                        obj.get_callnumber())
+                    new_log.sub_type = 'deliver'
+                    new_log.user_affected = req_user
                     new_log.admin_involved = g.user
-            elif obj.avail_type == 'Reserved':
-                # taken to deliver
-                if not self.check_post(obj):
-                    return self.response_forbidden()
 
-                obj.deliver()
-                new_log.content = ("take out disk %s for delivery" % 
-                                    obj.get_callnumber())
-                new_log.user_affected = req_user
-                new_log.admin_involved = g.user
+                else:
+                    # checkout
+                    if not self.check_post(obj):
+                        return self.response_forbidden()
 
-            else:
-                # checkout
-                if not self.check_post(obj):
+                    obj.check_out(req_user)
+                    new_log.content = ("check out disk %s for member %s" %
+                                    (obj.get_callnumber(), req_user.itsc))
+                    new_log.sub_type = 'checkout'
+                    new_log.user_affected = req_user
+                    new_log.admin_involved = g.user
+
+            elif request.method == 'DELETE':
+                if not self.check_delete(obj):
                     return self.response_forbidden()
 
-                obj.check_out(req_user)
-                new_log.content = ("check out disk %s for member %s" %
-                                (obj.get_callnumber(), req_user.itsc))
-                new_log.user_affected = req_user
+                obj.check_in()
+                new_log.content = "check in disk %s" % obj.get_callnumber()
+                new_log.sub_type = 'checkin'
                 new_log.admin_involved = g.user
 
-        elif request.method == 'DELETE':
-            if not self.check_delete(obj):
-                return self.response_forbidden()
-
-            obj.check_in()
-            new_log.content = "check in disk %s" % obj.get_callnumber()
-            new_log.admin_involved = g.user
-
-        obj.save()
-        new_log.save()
+            obj.save()
+            new_log.save()
         return self.object_detail(obj)
 
     def api_rate(self, pk):
         """API to acquire the ups and downs of a disk"""
         data = request.data or request.form.get('data') or ''
-        obj = get_object_or_404(self.get_query(), self.pk == pk)
+        obj = self.get_object(pk, fresh=(request.method != 'GET'))
 
         if request.method == 'GET':
             """Return the rates and whether a user has rated before"""
@@ -546,12 +843,8 @@ class DiskResource(LoggedRestResource):
         })
 
     def api_rand(self):
-        """API to return a random disk"""
-        obj = self.model.select().where(
-            self.model.disk_type << ['B']
-        ).order_by(fn.Rand()).limit(1).get()
-
-        return self.object_detail(obj)
+        """API to return a random disk, or ?n= of them"""
+        return self.random_response(self.rand_pool)
 
 
 class RegularFilmShowResource(LoggedRestResource):
@@ -566,6 +859,8 @@ class RegularFilmShowResource(LoggedRestResource):
         'vote_cnt_1', 'vote_cnt_2',
         'vote_cnt_3', 'participant_list'
     ]
+    # superseded by the tally of votes
+    exclude = ['vote_cnt_1', 'vote_cnt_2', 'vote_cnt_3']
 
     include_resources = {
         'film_1': DiskResource,
@@ -573,6 +868,7 @@ class RegularFilmShowResource(LoggedRestResource):
         'film_3': DiskResource,
         'create_log': SimpleLogResource,
     }
+    cached_relations = ['film_1', 'film_2', 'film_3']
 
     def get_query(self):
         """Hide drafts to member"""
@@ -606,7 +902,9 @@ class RegularFilmShowResource(LoggedRestResource):
         return data
 
     def prepare_data(self, obj, data):
-        if not (g.user and g.user.admin):
+        if g.user and g.user.admin:
+            data['participant_list'] = obj.get_participants()
+        else:
             data.pop('participant_list', None)
         return data
 
@@ -615,20 +913,20 @@ class RegularFilmShowResource(LoggedRestResource):
 
     def before_save(self, instance):
         instance = super(RegularFilmShowResource, self).before_save(instance)
+        film_ids = instance.get_film_ids()
 
         if instance.state == 'Open':
             # clear other voting or onshow disk
-            sq = Disk.select().where(Disk.avail_type << ['Voting', 'OnShow'])
-            for disk in sq:
-                disk.avail_type = 'Available'
-                disk.save()
+            Disk.update(avail_type='Available').where(
+                Disk.avail_type << ['Voting', 'OnShow']).execute()
             # put disk on voting
-            for x in [1, 2, 3]:
-                disk = getattr(instance, "film_%d" % x)
-                disk.avail_type = 'Voting'
-                for y in ['reserved_by', 'hold_by', 'due_at']:
-                    setattr(disk, y, None)
-                disk.save()
+            for disk in Disk.select().where(Disk.id << film_ids):
+                disk.release_holders(hold=True, reserve=True)
+            Disk.update(
+                avail_type='Voting', reserved_by=None,
+                hold_by=None, due_at=None
+            ).where(Disk.id << film_ids).execute()
+            model_changed(Disk)
 
         # set availability of corresponding disks
         if instance.id == RegularFilmShow.get_recent().id:
@@ -638,62 +936,85 @@ class RegularFilmShowResource(LoggedRestResource):
                 largest = instance.to_show()
 
                 # clear other disk
-                sq = Disk.select().where(Disk.avail_type << ['Voting', 'OnShow'])
-                for disk in sq:
-                    disk.avail_type = 'Available'
-                    disk.save()
+                Disk.update(avail_type='Available').where(
+                    Disk.avail_type << ['Voting', 'OnShow']).execute()
 
                 # set disk on show
-                largest.avail_type = 'Onshow'
-                largest.save()
+                Disk.update(avail_type='Onshow').where(
+                    Disk.id == largest.id).execute()
+                model_changed(Disk)
             elif instance.state == 'Passed':
-                for x in [1, 2, 3]:
-                    disk = getattr(instance, "film_%d" % x)
-                    if disk.avail_type == 'Voting' or disk.avail_type == 'Onshow':
-                        disk.avail_type = 'Available'
-                        disk.save()
+                Disk.update(avail_type='Available').where(
+                    Disk.id << film_ids,
+                    Disk.avail_type << ['Voting', 'Onshow']).execute()
+                model_changed(Disk)
         return instance
 
     def get_urls(self):
         return (
             ('/<pk>/vote/', self.require_method(self.api_vote, ['POST'])),
+            ('/<pk>/tally/', self.require_method(self.api_tally, ['GET'])),
             ('/<pk>/participant/', self.require_method(self.api_particip, ['POST'])),
         ) + super(RegularFilmShowResource, self).get_urls()
 
     def api_vote(self, pk):
         """API for Movote"""
-        obj = get_object_or_404(self.get_query(), self.pk == pk)
+        obj = self.get_object(pk, fresh=True)
         data = request.data or request.form.get("data") or ''
 
         data = self.data_precheck(data, VoteForm)
         if not g.user:
             return self.response_forbidden()
 
+        # the vote is stored by itself, no need to save
         obj.add_vote(g.user, data['film_id'])
-        obj.save()
         return self.response({})
 
+    def api_tally(self, pk):
+        """API to acquire the votes of each candidate film"""
+        obj = self.get_object(pk)
+        tally = obj.get_tally()
+
+        return self.response({
+            'objects': [{'film': film_id, 'votes': tally[film_id]}
+                        for film_id in sorted(tally)]
+        })
+
     def api_particip(self, pk):
-        """API to note down participants of a regular film show"""
-        obj = get_object_or_404(self.get_query(), self.pk == pk)
+        """API to note down participants of a regular film show
+
+        Accept either a user as {"id": 1} or a batch of scanned users
+        as {"ids": [1, 2, 3]}
+        """
+        obj = self.get_object(pk, fresh=True)
         data = request.data or request.form.get("data") or ''
 
         if not self.check_post(obj):
             return self.response_forbidden()
 
-        data = self.data_precheck(data, SubmitUserForm)
-        # existence has been verified
-        user = User.select().where(User.id == data['id']).get()
+        data = self.parse_json_object(data)
+        if 'ids' in data:
+            data = self.data_precheck(data, SubmitUserListForm)
+            users = list(User.select().where(User.id << data['ids']))
+            if len(users) != len(set(data['ids'])):
+                raise BusinessException("User not exist", 1)
+            signed = obj.signin_users(users)
+        else:
+            data = self.data_precheck(data, SubmitUserForm)
+            # existence has been verified
+            user = self.get_instance(User, int(data['id']))
+            obj.signin_user(user)
+            signed = [user]
 
-        obj.signin_user(user)
-        user.save()
-        obj.save()
-        Log.create(
-            model="RegularFilmShow", model_refer=obj.id,
-            log_type="entry", user_affected=user, admin_involved=g.user,
-            content="member %s enter RFS" % user.itsc)
+        for user in signed:
+            Log.create(
+                model="RegularFilmShow", model_refer=obj.id,
+                log_type="entry", user_affected=user, admin_involved=g.user,
+                content="member %s enter RFS" % user.itsc)
 
-        return self.response({})
+        return self.response({
+            'signed_in': [x.id for x in signed],
+        })
 
 
 class PreviewShowTicketResource(LoggedRestResource):
@@ -734,7 +1055,7 @@ class PreviewShowTicketResource(LoggedRestResource):
 
     def api_apply(self, pk):
         """API to apply for a ticket"""
-        obj = get_object_or_404(self.get_query(), self.pk == pk)
+        obj = self.get_object(pk, fresh=True)
         data = request.data or request.form.get("data") or ''
 
         if not g.user:
@@ -815,6 +1136,7 @@ class NewsResource(LoggedRestResource):
     """API of posting news
     """
     log_model = "News"
+    cache_control = 'public, no-cache'
     validate_form = NewsForm
 
     include_resources = {
@@ -832,6 +1154,7 @@ class DocumentResource(LoggedRestResource):
     """API of posting documet
     """
     log_model = "Document"
+    cache_control = 'public, no-cache'
     validate_form = DocumentForm
 
     include_resources = {
@@ -850,6 +1173,7 @@ class PublicationResource(LoggedRestResource):
     """API of posting publications
     """
     log_model = "Publication"
+    cache_control = 'public, no-cache'
     validate_form = PublicationForm
 
     include_resources = {
@@ -877,6 +1201,7 @@ class SponsorResource(LoggedRestResource):
     """API of posting sponsors
     """
     log_model = "Sponsor"
+    cache_control = 'public, no-cache'
     validate_form = SponsorForm
 
     include_resources = {
@@ -891,16 +1216,21 @@ class SponsorResource(LoggedRestResource):
         return "%s sponsor %s" % (g.modify_flag, instance.name)
 
 
-class ExcoResource(HookedResource):
+class ExcoResource(LoggedRestResource):
     """API of exco information
     """
+    log_model = "Exco"
     validate_form = ExcoForm
+    cache_control = 'public, no-cache'
 
     readonly = ['position']
     include_resources = {
         'img_url': FileResource,
     }
 
+    def get_log(self, instance, id):
+        return "%s exco %s" % (g.modify_flag, instance.name_en)
+
     def check_post(self, obj=None):
         return g.user and g.user.admin and obj
 
@@ -920,6 +1250,11 @@ class SiteSettingsResource(HookedResource):
     def check_delete(self, obj):
         return False
 
+    def after_save(self, instance=None):
+        """Drop the settings snapshot so that the change takes effect
+        """
+        SiteSettings.invalidate()
+
 
 class OneSentenceResource(LoggedRestResource):
     """API of quotes from films
@@ -927,6 +1262,9 @@ class OneSentenceResource(LoggedRestResource):
     log_model = "OneSentence"
     validate_form = OneSentenceForm
 
+    # candidates of random picks
+    rand_pool = RandomPool(OneSentence)
+
     search = {
         'default': ['film', 'content']
     }
@@ -946,10 +1284,8 @@ class OneSentenceResource(LoggedRestResource):
         ) + super(OneSentenceResource, self).get_urls()
 
     def api_rand(self):
-        """API of a rand quote"""
-        obj = self.model.select().order_by(fn.Rand()).limit(1).get()
-
-        return self.object_detail(obj)
+        """API of a rand quote, or ?n= of them"""
+        return self.random_response(self.rand_pool)
 
 # use a centered dirty generator
 # dirty map
@@ -987,6 +1323,22 @@ def dirty():
     return Response(json.dumps(result, **kwargs), mimetype='application/json')
 
 
+# report the hit ratios of the object cache
+@app.route('/api/cache/')
+def cache_stats():
+    if not (g.user and g.user.admin):
+        return jsonify(errno=403, error="Not Authorized")
+    return jsonify(errno=0, error='', objects=object_cache.stats())
+
+
+# report the latency of ticket validation with the CAS server
+@app.route('/api/cas/')
+def cas_stats():
+    if not (g.user and g.user.admin):
+        return jsonify(errno=403, error="Not Authorized")
+    return jsonify(errno=0, error='', objects=flask_cas.metrics.report())
+
+
 # fit for common users
 user_auth = BaseAuthentication(auth)
 
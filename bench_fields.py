@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# A little script to compare the lazy decoding of SimpleListField and
+# JSONField with decoding every value as it is loaded. No database is
+# needed, rows of text are made up, e.g.
+#     python bench_fields.py 40 1000
+
+import sys
+import timeit
+from string import split, join
+
+from flask import json
+
+from db_ext import SimpleListField, JSONField
+
+
+def bench(name, f, number):
+    """Print the microseconds f takes per call on average"""
+    seconds = timeit.timeit(f, number=number)
+    print "%-36s %8.1f us" % (name, seconds * 1000000 / number)
+
+
+def eager_list(value):
+    """SimpleListField.python_value as it was"""
+    if value is None or len(value.strip()) == 0:
+        return []
+    return map(lambda x: x.strip(), split(value, ','))
+
+
+def eager_list_db(value):
+    """SimpleListField.db_value as it was"""
+    return join(map(unicode, value), ',')
+
+
+def make_rows(size):
+    """Return size rows of (actors, tags, variants) as stored"""
+    rows = []
+    for i in xrange(size):
+        actors = ', '.join(u'Actor %d-%d' % (i, x) for x in xrange(8))
+        tags = ','.join(u'tag%d' % x for x in xrange(i % 5, i % 5 + 6))
+        variants = json.dumps({'thumb': 'f%d_thumb.jpg' % i,
+                               'medium': 'f%d_medium.jpg' % i})
+        rows.append((actors, tags, variants))
+    return rows
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rows = make_rows(size)
+    lst = SimpleListField()
+    js = JSONField()
+
+    # check both ways decode the same
+    for actors, tags, variants in rows:
+        assert lst.python_value(actors).decode() == eager_list(actors)
+        assert js.python_value(variants).decode() == json.loads(variants)
+
+    def load_eager():
+        for actors, tags, variants in rows:
+            eager_list(actors)
+            eager_list(tags)
+            json.loads(variants)
+
+    def load_lazy():
+        for actors, tags, variants in rows:
+            lst.python_value(actors)
+            lst.python_value(tags)
+            js.python_value(variants)
+
+    def read_lazy():
+        for actors, tags, variants in rows:
+            lst.python_value(actors).decode()
+            lst.python_value(tags).decode()
+            js.python_value(variants).decode()
+
+    eager = [(eager_list(a), eager_list(t)) for a, t, v in rows]
+    lazy = [(lst.python_value(a).decode(), lst.python_value(t).decode())
+            for a, t, v in rows]
+
+    def save_eager():
+        for actors, tags in eager:
+            eager_list_db(actors)
+            eager_list_db(tags)
+
+    def save_lazy():
+        for actors, tags in lazy:
+            lst.db_value(actors)
+            lst.db_value(tags)
+
+    print "%d rows" % size
+    bench("load, decoded eagerly", load_eager, number)
+    bench("load, never read", load_lazy, number)
+    bench("load, every field read", read_lazy, number)
+    bench("db_value of lists, joined again", save_eager, number)
+    bench("db_value of lists, unchanged", save_lazy, number)
+
+if __name__ == '__main__':
+    main()
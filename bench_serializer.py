@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# A little script to compare the compiled serializer of resources with
+# the generic one of flask-peewee on list pages of Disk and Log.
+# Run it against a database with some rows, e.g.
+#     python bench_serializer.py 40 200
+
+import sys
+import timeit
+
+from flask import json
+
+from app import app
+from models import *
+from frame_ext import Serializer
+from api import api
+
+
+def bench(name, f, number):
+    """Print the milliseconds f takes per call on average"""
+    seconds = timeit.timeit(f, number=number)
+    print "%-28s %8.3f ms" % (name, seconds * 1000 / number)
+
+
+def bench_resource(model, page_size, number):
+    """Serialize a page of a model in the generic and compiled ways
+
+    Both ways serialize the same rows, with the related objects already
+    loaded, so only the cost of serializing is measured
+    """
+    resource = api._registry[model]
+    objects = list(model.select().order_by(model.id.desc())
+                    .paginate(1, page_size))
+    generic = Serializer()
+    compiled = resource.get_compiled_serializer()
+
+    # warm up the caches of related objects and check the outputs
+    for obj in objects:
+        assert generic.serialize_object(
+            obj, resource._fields, resource._exclude) == \
+            compiled.serialize_object(obj)
+
+    def run_generic():
+        for obj in objects:
+            json.dumps(generic.serialize_object(
+                obj, resource._fields, resource._exclude))
+
+    def run_compiled():
+        for obj in objects:
+            json.dumps(compiled.serialize_object(obj))
+
+    print "%s, %d rows" % (model.__name__, len(objects))
+    bench("generic", run_generic, number)
+    bench("compiled", run_compiled, number)
+
+    if compiled.is_flat():
+        query = model.select().order_by(model.id.desc()).paginate(
+            1, page_size)
+
+        def run_tuples():
+            for data in compiled.serialize_tuples(query):
+                json.dumps(data)
+
+        bench("compiled from tuples", run_tuples, number)
+
+
+def main():
+    page_size = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    with app.test_request_context():
+        bench_resource(Disk, page_size, number)
+        bench_resource(Log, page_size, number)
+        # nests nothing, so can be serialized from tuples as well
+        bench_resource(File, page_size, number)
+
+if __name__ == '__main__':
+    main()
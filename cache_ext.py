@@ -0,0 +1,372 @@
+import time
+import random
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+from app import app
+
+__all__ = [
+    'TimedCache',
+    'LRUCache',
+    'ObjectCache',
+    'object_cache',
+    'RandomPool',
+    'on_model_change',
+    'model_changed',
+]
+
+
+class TimedCache(object):
+    """A thread-safe in-process key-value cache with expiring entries
+
+    The website runs in several processes, and a write can only
+    invalidate the cache of the process serving it. The ttl bounds how
+    long the other processes may keep serving a stale value.
+
+    :param ttl:
+        The seconds an entry stays valid
+    """
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value of a key, or default if missing or expired
+
+        :param key:
+            The key to look up
+        :param default:
+            The value returned on a miss
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[1] < time.time():
+                del self._data[key]
+                return default
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Store a value under a key
+
+        :param key:
+            The key to store
+        :param value:
+            The value to store
+        :param ttl:
+            The seconds the entry stays valid, default to the ttl of
+            the cache
+        """
+        expire = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expire)
+
+    def delete(self, key):
+        """Remove a key from the cache"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all the keys from the cache"""
+        with self._lock:
+            self._data.clear()
+
+
+class LRUCache(TimedCache):
+    """A TimedCache holding at most a number of entries. The least
+    recently used entry is dropped when the cache is full.
+
+    :param capacity:
+        The maximum number of entries
+    :param ttl:
+        The seconds an entry stays valid
+    """
+    def __init__(self, capacity=1024, ttl=60):
+        super(LRUCache, self).__init__(ttl)
+        self.capacity = capacity
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            if entry[1] < time.time():
+                return default
+            # move to the most recently used end
+            self._data[key] = entry
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expire = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expire)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+
+class ObjectCache(object):
+    """A read-through cache of model instances keyed by model and
+    primary key
+
+    Rows are kept pickled in an in-process LRU, and in a shared backend
+    if one is supplied, so every hit returns a fresh instance that can
+    be modified freely. The backend is any object with the interface of
+    werkzeug.contrib.cache, e.g. MemcachedCache.
+
+    The same row may be visible to some users but not others, so the
+    caller supplies a scope naming the query used to look it up.
+
+    :param capacity:
+        The maximum number of rows kept in process
+    :param ttl:
+        The seconds a row stays valid
+    :param backend:
+        The shared cache backend, optional
+    """
+    def __init__(self, capacity=1024, ttl=60, backend=None):
+        self.local = LRUCache(capacity, ttl)
+        self.backend = backend
+        self.ttl = ttl
+        self._stats = {}
+        # model -> the time the model is invalidated as a whole
+        self._epochs = {}
+
+    def _key(self, model, scope, pk):
+        return '%s:%s:%s' % (model._meta.db_table, scope, pk)
+
+    def _epoch_key(self, model):
+        return '%s:epoch' % model._meta.db_table
+
+    def _changes_key(self, model):
+        return '%s:changes' % model._meta.db_table
+
+    def _count(self, model, hit):
+        stat = self._stats.setdefault(
+            model._meta.db_table, {'hits': 0, 'misses': 0})
+        stat['hits' if hit else 'misses'] += 1
+
+    def _load(self, model, key, local=True):
+        """Return the pickled row of a key, or None"""
+        entry = self.local.get(key) if local else None
+        if entry is None and self.backend is not None:
+            entry, epoch = self.backend.get_many(
+                key, self._epoch_key(model))
+            if entry is not None and epoch and entry[0] <= epoch:
+                # the model is invalidated after the row is stored
+                entry = None
+            if entry is not None and local:
+                self.local.set(key, entry)
+        if entry is not None and \
+                entry[0] <= self._epochs.get(model, 0):
+            entry = None
+        return entry and entry[1]
+
+    def fetch(self, query, pk, scope='', local=True):
+        """Return the instance of pk selected by query
+
+        Raise DoesNotExist if there is no such instance.
+
+        :param query:
+            The query to select the instance from on a miss
+        :param pk:
+            The primary key of the instance
+        :param scope:
+            The name of the query, instances looked up with different
+            queries are stored separately
+        :param local:
+            Whether the row may be kept in process. Rows which must
+            follow changes made by other processes at once are kept in
+            the backend only, if there is one.
+        """
+        model = query.model_class
+        local = local or self.backend is None
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            # never cache unusual keys, let the query decide
+            return query.where(model._meta.primary_key == pk).get()
+
+        key = self._key(model, scope, pk)
+        data = self._load(model, key, local)
+        if data is not None:
+            self._count(model, True)
+            obj = model(**pickle.loads(data))
+            # as loaded from the database, nothing is modified
+            obj.prepared()
+            return obj
+
+        self._count(model, False)
+        obj = query.where(model._meta.primary_key == pk).get()
+        entry = (time.time(), pickle.dumps(obj._data, 2))
+        if local:
+            self.local.set(key, entry)
+        if self.backend is not None:
+            self.backend.set(key, entry, timeout=self.ttl)
+        return obj
+
+    def invalidate(self, model, pk=None, scopes=('',)):
+        """Drop the cached instances of a model
+
+        :param model:
+            The model changed
+        :param pk:
+            The primary key of the instance changed. If None, all the
+            instances of the model are dropped
+        :param scopes:
+            The scopes the instance may be cached in
+        """
+        if pk is None:
+            now = time.time()
+            self._epochs[model] = now
+            if self.backend is not None:
+                self.backend.set(
+                    self._epoch_key(model), now, timeout=self.ttl)
+            return
+        keys = [self._key(model, scope, pk) for scope in scopes]
+        for key in keys:
+            self.local.delete(key)
+        if self.backend is not None:
+            self.backend.delete_many(*keys)
+
+    def count_change(self, model):
+        """Count a change of a model in the shared backend, so that
+        other processes can tell what they derived from it is outdated
+
+        :param model:
+            The model changed
+        """
+        if self.backend is not None:
+            key = self._changes_key(model)
+            self.backend.add(key, 0)
+            self.backend.inc(key)
+
+    def get_changes(self, model):
+        """Return the number of changes of a model counted in the shared
+        backend, or None without a backend. The number differs from the
+        one read before once the model changes.
+
+        :param model:
+            The model to look up
+        """
+        if self.backend is None:
+            return None
+        return self.backend.get(self._changes_key(model)) or 0
+
+    def stats(self):
+        """Return the hits, misses and hit ratio of each model"""
+        result = {}
+        for table, stat in self._stats.items():
+            total = stat['hits'] + stat['misses']
+            result[table] = dict(stat, ratio=(
+                float(stat['hits']) / total if total else 0.0))
+        return result
+
+
+object_cache = ObjectCache(
+    app.config.get('OBJECT_CACHE_SIZE', 1024),
+    app.config.get('OBJECT_CACHE_TTL', 60),
+    app.config.get('OBJECT_CACHE_BACKEND', None))
+
+# scopes instances are cached in
+CACHE_SCOPES = ('', 'public', 'admin', 'session')
+
+# listeners to changes of models
+_listeners = []
+
+
+def on_model_change(f):
+    """Register a function to be called as f(model, pk) when an instance
+    of a model changes. pk is None if many instances may change.
+    """
+    _listeners.append(f)
+    return f
+
+
+def model_changed(model, pk=None):
+    """Notify the object cache and listeners that a model changed
+
+    :param model:
+        The model changed
+    :param pk:
+        The primary key of the instance changed, or None if many
+        instances may change
+    """
+    object_cache.invalidate(model, pk, CACHE_SCOPES)
+    object_cache.count_change(model)
+    for listener in _listeners:
+        listener(model, pk)
+
+
+class RandomPool(object):
+    """Pick random instances of a model uniformly without ORDER BY RAND()
+
+    The IDs of the candidates are kept in memory, so a pick costs O(1)
+    and the instance is then fetched by primary key through the object
+    cache. The IDs are reloaded after the model changes or the ttl.
+
+    :param model:
+        The model to pick from
+    :param where:
+        A list of the expressions the candidates must satisfy
+    :param ttl:
+        The seconds the IDs stay valid
+    """
+    def __init__(self, model, where=None, ttl=None):
+        self.model = model
+        self.where = where or []
+        self.ttl = app.config.get('RANDOM_POOL_TTL', 300) \
+            if ttl is None else ttl
+        self._ids = None
+        self._expire = 0
+        self._lock = threading.Lock()
+        _pools.append(self)
+
+    def ids(self):
+        """Return the list of IDs of the candidates"""
+        with self._lock:
+            if self._ids is None or self._expire < time.time():
+                pk = self.model._meta.primary_key
+                sq = self.model.select(pk)
+                if self.where:
+                    sq = sq.where(*self.where)
+                self._ids = [x[0] for x in sq.tuples()]
+                self._expire = time.time() + self.ttl
+            return self._ids
+
+    def invalidate(self):
+        """Reload the IDs on the next pick"""
+        with self._lock:
+            self._ids = None
+
+    def sample(self, n=1):
+        """Return at most n distinct instances picked at random
+
+        :param n:
+            The number of instances to pick
+        """
+        ids = self.ids()
+        result = []
+        for pk in random.sample(ids, min(n, len(ids))):
+            try:
+                result.append(object_cache.fetch(self.model.select(), pk))
+            except self.model.DoesNotExist:
+                # deleted by another process
+                self.invalidate()
+        return result
+
+
+# pools of random picks
+_pools = []
+
+
+@on_model_change
+def refresh_pools(model, pk):
+    """Drop the IDs of pools of a model once it changes"""
+    for pool in _pools:
+        if pool.model is model:
+            pool.invalidate()
@@ -0,0 +1,193 @@
+import math
+import time
+import threading
+from array import array
+
+from app import app
+from models import *
+from cache_ext import object_cache, on_model_change
+
+__all__ = [
+    'Catalogue',
+    'catalogue',
+]
+
+
+class Catalogue(object):
+    """A compact in-process index of all the disks for browsing the
+    library by popularity, rank or newest first
+
+    For every disk only (id, rank, borrow_cnt, avail_type, disk_type) is
+    kept, in parallel arrays. The orders are sorted lazily and kept
+    until a disk changes, so pages and totals are answered without
+    touching the database. Writes in this process patch the index.
+    Writes of other processes are told by the changes of disks counted
+    in the shared backend of the object cache, or show up after the ttl
+    without a backend.
+
+    :param ttl:
+        The seconds until the index is rebuilt from the database
+    """
+    modes = ('popular', 'rank', 'newest')
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._expire = 0
+        self._orders = {}
+        # the changes of disks counted when the index is loaded
+        self._changes = None
+
+    def rebuild(self):
+        """Load the index of all the disks from the database"""
+        # read before the disks, a change in between is seen next time
+        changes = object_cache.get_changes(Disk)
+        sq = Disk.select(
+            Disk.id, Disk.rank, Disk.borrow_cnt,
+            Disk.avail_type, Disk.disk_type).tuples()
+        with self._lock:
+            self.ids = array('l')
+            self.ranks = array('d')
+            self.borrow_cnts = array('l')
+            self.avail_types = []
+            self.disk_types = array('c')
+            # disk ID -> the position in the arrays
+            self.positions = {}
+            for row in sq.iterator():
+                self._append(row)
+            self._orders = {}
+            self._expire = time.time() + self.ttl
+            self._changes = changes
+
+    def _append(self, row):
+        disk_id, rank, borrow_cnt, avail_type, disk_type = row
+        self.positions[disk_id] = len(self.ids)
+        self.ids.append(disk_id)
+        self.ranks.append(rank or 0.0)
+        self.borrow_cnts.append(borrow_cnt or 0)
+        # only a handful of distinct states, share the strings
+        self.avail_types.append(intern(str(avail_type)))
+        self.disk_types.append(str(disk_type or ' ')[0])
+
+    def _remove(self, disk_id):
+        # move the last disk into the hole
+        i = self.positions.pop(disk_id)
+        last = len(self.ids) - 1
+        if i != last:
+            self.positions[self.ids[last]] = i
+            for column in [self.ids, self.ranks, self.borrow_cnts,
+                            self.avail_types, self.disk_types]:
+                column[i] = column[last]
+        for column in [self.ids, self.ranks, self.borrow_cnts,
+                        self.avail_types, self.disk_types]:
+            column.pop()
+
+    def _check(self):
+        if self._expire < time.time() or \
+                object_cache.get_changes(Disk) != self._changes:
+            self.rebuild()
+
+    def invalidate(self):
+        """Rebuild the index on next lookup"""
+        with self._lock:
+            self._expire = 0
+
+    def patch(self, disk_id):
+        """Reload a disk into the index
+
+        :param disk_id:
+            The ID of the disk changed
+        """
+        changes = object_cache.get_changes(Disk)
+        sq = Disk.select(
+            Disk.id, Disk.rank, Disk.borrow_cnt,
+            Disk.avail_type, Disk.disk_type
+        ).where(Disk.id == disk_id).tuples()
+        rows = list(sq)
+        with self._lock:
+            if not self._expire:
+                # to be rebuilt anyway
+                return
+            if changes is not None and changes != self._changes + 1:
+                # other disks changed elsewhere besides this one
+                self._expire = 0
+                return
+            self._changes = changes
+            if disk_id in self.positions:
+                self._remove(disk_id)
+            for row in rows:
+                self._append(row)
+            self._orders = {}
+
+    def _sort_key(self, mode):
+        # positions in the arrays sort ascending by the key
+        ids, ranks, borrow_cnts = self.ids, self.ranks, self.borrow_cnts
+        if mode == 'popular':
+            return lambda i: (-borrow_cnts[i], -ids[i])
+        if mode == 'rank':
+            return lambda i: (-ranks[i], -ids[i])
+        return lambda i: -ids[i]
+
+    def get_order(self, mode, public=False):
+        """Return an array of disk IDs in the order of a mode
+
+        :param mode:
+            One of popular, rank and newest
+        :param public:
+            Whether drafts are left out
+        """
+        with self._lock:
+            self._check()
+            order = self._orders.get((mode, public))
+            if order is None:
+                positions = xrange(len(self.ids))
+                if public:
+                    positions = [i for i in positions
+                                    if self.avail_types[i] != 'Draft']
+                order = array('l', [self.ids[i] for i in
+                                    sorted(positions,
+                                        key=self._sort_key(mode))])
+                self._orders[(mode, public)] = order
+            return order
+
+    def count(self, public=False):
+        """Return the number of disks
+
+        :param public:
+            Whether drafts are left out
+        """
+        return len(self.get_order('newest', public))
+
+    def get_page(self, mode, page, size, public=False):
+        """Return (disks on a page, the number of pages)
+
+        :param mode:
+            One of popular, rank and newest
+        :param page:
+            The page number, starting from 1
+        :param size:
+            The number of disks on a page
+        :param public:
+            Whether drafts are left out
+        """
+        order = self.get_order(mode, public)
+        pages = int(math.ceil(float(len(order)) / size))
+        ids = order[(page - 1) * size:page * size].tolist()
+        if not ids:
+            return [], pages
+        disks = dict((x.id, x) for x in Disk.select().where(Disk.id << ids))
+        return [disks[x] for x in ids if x in disks], pages
+
+
+catalogue = Catalogue(app.config.get('CATALOGUE_TTL', 300))
+
+
+@on_model_change
+def patch_catalogue(model, pk):
+    """Keep the catalogue in step with changes of disks"""
+    if model is not Disk:
+        return
+    if pk is None:
+        catalogue.invalidate()
+    else:
+        catalogue.patch(pk)
@@ -1,18 +1,145 @@
-from string import split, join
-
 from flask import json
-from peewee import TextField
+from peewee import TextField, FieldDescriptor
+
+# peewee wraps the errors of the driver since 2.3
+try:
+    from peewee import IntegrityError
+except ImportError:
+    from MySQLdb import IntegrityError
 
 __all__ = [
     'SimpleListField',
     'JSONField',
+    'IntegrityError',
+    'Encoded',
+    'TrackedList',
 ]
 
 
-class SimpleListField(TextField):
+class Encoded(object):
+    """A value as stored in the database, decoded on first access.
+    Plain text decodes to itself.
+
+    :param raw:
+        The text stored
+    """
+    __slots__ = ('raw',)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __reduce__(self):
+        return (type(self), (self.raw,))
+
+    def decode(self):
+        """Return the value in Python"""
+        return self.raw
+
+
+class EncodedList(Encoded):
+    """The text of a SimpleListField"""
+    __slots__ = ()
+
+    def decode(self):
+        raw = self.raw
+        if raw.strip():
+            value = TrackedList([x.strip() for x in raw.split(',')])
+        else:
+            value = TrackedList()
+        value.raw = raw
+        return value
+
+
+class EncodedJSON(Encoded):
+    """The text of a JSONField"""
+    __slots__ = ()
+
+    def decode(self):
+        return json.loads(self.raw)
+
+
+class TrackedList(list):
+    """A list which remembers the text it is decoded from in raw, until
+    it is modified. raw is None if it has to be encoded again.
+    """
+    raw = None
+
+
+def _modifier(name):
+    method = getattr(list, name)
+
+    def modify(self, *args, **kwargs):
+        self.raw = None
+        return method(self, *args, **kwargs)
+    modify.__name__ = name
+    return modify
+
+for _name in ['__setitem__', '__delitem__', '__setslice__', '__delslice__',
+              '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop',
+              'remove', 'reverse', 'sort']:
+    setattr(TrackedList, _name, _modifier(_name))
+
+
+class LazyFieldDescriptor(FieldDescriptor):
+    """Decode the value of a field on first access and keep the result
+    in the instance
+    """
+    def __get__(self, instance, instance_type=None):
+        if instance is None:
+            return self.field
+        value = instance._data.get(self.att_name)
+        if isinstance(value, Encoded):
+            value = instance._data[self.att_name] = value.decode()
+        return value
+
+
+class LazyTextField(TextField):
+    """A long text holding an encoded value, which is decoded only when
+    the field is read. Rows loaded keep the text in an Encoded, so
+    fields never read cost nothing, and are written back as they are.
+    Subclasses override encode() and python_value() for their format;
+    by default the text is kept as it is.
+    """
+    def add_to_class(self, model_class, name):
+        super(LazyTextField, self).add_to_class(model_class, name)
+        setattr(model_class, name, LazyFieldDescriptor(self))
+
+    def encode(self, value):
+        """Return the text of a value in Python"""
+        return value
+
+    def python_value(self, value):
+        """Keep the text to decode on first access"""
+        if value is None:
+            return None
+        return Encoded(value)
+
+    def get_raw(self, value):
+        """Return the text a value is decoded from if it is unchanged,
+        otherwise None
+        """
+        if isinstance(value, Encoded):
+            return value.raw
+        return None
+
+    def is_clean(self, value):
+        """Return whether a value is unchanged since it is loaded"""
+        return self.get_raw(value) is not None
+
+    def db_value(self, value):
+        """Convert a value to be used to construct SQL"""
+        raw = self.get_raw(value)
+        if raw is not None:
+            return raw
+        return self.encode(value)
+
+
+class SimpleListField(LazyTextField):
     """A simulated list field in Database
 
-    It is in fact a long text. ',' perfoms as delimiter.
+    It is in fact a long text. ',' perfoms as delimiter. Values loaded
+    are TrackedList, which are not joined again on save unless
+    modified.
     """
     def to_str(self, x):
         """Convert a value to string form"""
@@ -20,28 +147,35 @@ class SimpleListField(TextField):
             return x
         return unicode(x)
 
-    def db_value(self, value):
-        """Convert a value to be used to construct SQL"""
+    def get_raw(self, value):
+        if isinstance(value, TrackedList):
+            return value.raw
+        return super(SimpleListField, self).get_raw(value)
+
+    def encode(self, value):
         if value is None:
             return ''
-        return join(map(self.to_str, value), ',') if isinstance(value, list) else value
+        return ','.join(map(self.to_str, value)) if isinstance(value, list) else value
 
     def python_value(self, value):
-        """Parse and use in Python"""
-        if value is None or len(value.strip()) == 0:
-            return []
-        return map(lambda x: x.strip(), split(value, ','))
+        """Parse and use in Python, on first access"""
+        return EncodedList(value or '')
 
 
-class JSONField(TextField):
+class JSONField(LazyTextField):
     """A simulated JSON field in Database
 
-    It is in fact a long text storing a JSON text.
+    It is in fact a long text storing a JSON text. None is stored as
+    NULL. Dicts and lists may be modified deep inside, so values once
+    decoded are always dumped again on save.
     """
-    def db_value(self, value):
-        """Convert a value to be used to construct SQL"""
+    def encode(self, value):
+        if value is None:
+            return None
         return json.dumps(value)
 
     def python_value(self, value):
-        """Parse and use in Python"""
-        return json.loads(value)
+        """Parse and use in Python, on first access"""
+        if value is None or value == '':
+            return None
+        return EncodedJSON(value)
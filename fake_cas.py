@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# A little script to run a fake CAS server for testing logins locally.
+# Point AUTH_SERVER of the settings to it, e.g. http://localhost:8081
+#
+# /cas/login?service=...&user=<itsc> redirects back to the service with
+# a ticket for the user, which /cas/validate and /cas/serviceValidate
+# accept once. A delay in seconds on the command line slows every
+# validation down, to try the timeouts.
+#
+# Usage: python fake_cas.py [port] [delay]
+
+import sys
+import time
+import uuid
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+# ticket -> (service, user)
+tickets = {}
+
+# seconds to wait before answering a validation
+delay = 0.0
+
+SUCCESS = """<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>%s</cas:user>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+FAILURE = """<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationFailure code="INVALID_TICKET">
+        Ticket %s not recognized
+    </cas:authenticationFailure>
+</cas:serviceResponse>
+"""
+
+
+class CASHandler(BaseHTTPRequestHandler):
+    # keep connections alive as a real server does
+    protocol_version = "HTTP/1.1"
+
+    def send(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def validate(self, args):
+        """Return the user of the ticket in args, or None"""
+        time.sleep(delay)
+        ticket = args.get("ticket", "")
+        service, user = tickets.pop(ticket, (None, None))
+        if service != args.get("service"):
+            return None
+        return user
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        args = dict(urlparse.parse_qsl(url.query))
+
+        if url.path == "/cas/login":
+            ticket = "ST-%s" % uuid.uuid4().hex
+            tickets[ticket] = (args.get("service"), args.get("user", "test"))
+            service = args.get("service", "")
+            sep = "&" if "?" in service else "?"
+            self.send(302, "", {"Location": service + sep +
+                urllib.urlencode({"ticket": ticket})})
+        elif url.path == "/cas/validate":
+            user = self.validate(args)
+            self.send(200, "yes\n%s\n" % user if user else "no\n\n")
+        elif url.path == "/cas/serviceValidate":
+            user = self.validate(args)
+            self.send(200, SUCCESS % user if user else
+                FAILURE % args.get("ticket", ""),
+                {"Content-Type": "text/xml"})
+        elif url.path == "/cas/logout":
+            self.send(302, "", {"Location": args.get("url", "/")})
+        else:
+            self.send(404, "Not Found")
+
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    global delay
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    print "Fake CAS server on http://localhost:%d" % port
+    ThreadedServer(("", port), CASHandler).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# A little script to count the references to each uploaded file, from
+# disk covers, tickets, documents, publications, sponsors, excos and the
+# header image in site settings. Files no longer referred to are listed
+# as candidates for garbage collection.
+#
+# Usage: python file_usage.py [--all]
+# With --all every file is listed with its reference count.
+
+import sys
+
+from peewee import ForeignKeyField, fn
+
+from models import *
+from migrate import all_models
+
+
+def file_references():
+    """Return a list of (model, field) referring to File"""
+    result = []
+    for model in all_models:
+        for field in model._meta.fields.values():
+            if isinstance(field, ForeignKeyField) and \
+                    field.rel_model is File:
+                result.append((model, field))
+    return result
+
+
+def count_references():
+    """Return a dict of file ID -> the number of references"""
+    counts = {}
+    for model, field in file_references():
+        sq = model.select(
+            field, fn.Count(model.id)).group_by(field).tuples()
+        for file_id, cnt in sq:
+            # NULL references are grouped under None
+            counts[file_id] = counts.get(file_id, 0) + cnt
+
+    # the header image is kept as a setting
+    header_image = SiteSettings.get_int('header_image')
+    if header_image:
+        counts[header_image] = counts.get(header_image, 0) + 1
+    return counts
+
+
+def main():
+    show_all = '--all' in sys.argv[1:]
+    counts = count_references()
+
+    unused = 0
+    for file_id, name, url in File.select(
+            File.id, File.name, File.url).order_by(File.id).tuples():
+        cnt = counts.get(file_id, 0)
+        unused += not cnt
+        if show_all or not cnt:
+            print "%6d %3d %s (%s)" % (file_id, cnt, url, name)
+    print "%d files not referred to" % unused
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,19 @@ from auth import *
 from models import *
 from api import api
 import static_host
+from catalogue import catalogue
+from thumbnail import start_pool
 
 
 # setup urls
 api.setup()
 
+# fork the thumbnail workers before the database is connected
+start_pool()
+
+# preload the site settings snapshot and the library catalogue
+app.before_first_request(SiteSettings.load)
+app.before_first_request(catalogue.rebuild)
+
 if __name__ == '__main__':
     app.run()
@@ -43,28 +43,153 @@ CAS_MSG = (
 
 from app import app
 from flask import request
+import httplib
 import md5
+import socket
+import threading
 import time
 import urllib
 import urlparse
-
-
-#  Used for parsing xml.  Search str for first occurance of
-#  <tag>.....</tag> and return text (striped of leading and
-#  trailing whitespace) between tags.  Return "" if tag not
-#  found.
-def parse_tag(str, tag):
-    tag1_pos1 = str.find("<" + tag)
-    #  No tag found, return empty string.
-    if tag1_pos1 == -1:
-        return ""
-    tag1_pos2 = str.find(">", tag1_pos1)
-    if tag1_pos2 == -1:
+from collections import deque
+from Queue import Queue, Empty, Full
+from xml.etree import cElementTree as ElementTree
+
+#  Namespace of CAS 2.0 responses
+CAS_NS = "{http://www.yale.edu/tp/cas}"
+
+#  A pool of keep-alive HTTP(S) connections to one CAS server.
+#  Every request is bounded by the timeout.
+class ConnectionPool(object):
+    def __init__(self, cas_host, timeout=5, size=4):
+        url = urlparse.urlsplit(cas_host)
+        self.https = url.scheme == 'https'
+        self.netloc = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self._idle = Queue(size)
+
+    def connect(self):
+        cls = httplib.HTTPSConnection if self.https else httplib.HTTPConnection
+        return cls(self.netloc, timeout=self.timeout)
+
+    #  GET path from the server, return (status, body)
+    def get(self, path):
+        try:
+            conn, reused = self._idle.get_nowait(), True
+        except Empty:
+            conn, reused = self.connect(), False
+        try:
+            conn.request("GET", self.prefix + path)
+            response = conn.getresponse()
+            result = response.status, response.read()
+        except socket.timeout:
+            conn.close()
+            raise
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            if not reused:
+                raise
+            #  The server may have closed an idle connection, retry once
+            conn = self.connect()
+            try:
+                conn.request("GET", self.prefix + path)
+                response = conn.getresponse()
+                result = response.status, response.read()
+            except Exception:
+                conn.close()
+                raise
+        if response.will_close:
+            conn.close()
+        else:
+            try:
+                self._idle.put_nowait(conn)
+            except Full:
+                conn.close()
+        return result
+
+
+#  Latency of round trips to CAS servers, in milliseconds
+class Metrics(object):
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, elapsed, error=False):
+        with self._lock:
+            self.count += 1
+            self.errors += int(error)
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+            self.recent.append(elapsed)
+
+    #  Return a dict of the metrics
+    def report(self):
+        with self._lock:
+            recent = sorted(self.recent)
+        percentile = lambda p: (
+            recent[min(int(len(recent) * p), len(recent) - 1)]
+            if recent else 0.0)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'max_ms': self.max,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+        }
+
+
+metrics = Metrics()
+
+#  cas_host -> ConnectionPool
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(cas_host):
+    with _pools_lock:
+        pool = _pools.get(cas_host)
+        if pool is None:
+            pool = _pools[cas_host] = ConnectionPool(
+                cas_host,
+                app.config.get('CAS_TIMEOUT', 5),
+                app.config.get('CAS_POOL_SIZE', 4))
+        return pool
+
+
+#  Ask the CAS server at cas_host to validate a ticket, return the body
+#  of the response or None if the server fails or times out.
+def fetch_validation(cas_host, path, service_url, ticket, opt):
+    query = {"ticket": ticket, "service": service_url}
+    if opt:
+        query[opt] = "true"
+    start = time.time()
+    try:
+        status, body = get_pool(cas_host).get(
+            path + "?" + urllib.urlencode(query))
+    except (httplib.HTTPException, socket.error), e:
+        metrics.record((time.time() - start) * 1000, True)
+        app.logger.warning("CAS validation failed: %s", e)
+        return None
+    metrics.record((time.time() - start) * 1000, status != 200)
+    return body if status == 200 else None
+
+
+#  Return the user of a CAS 2.0 serviceValidate response, or "" if
+#  the ticket is rejected or the response is malformed.
+def parse_cas_2(body):
+    try:
+        root = ElementTree.fromstring(body)
+    except SyntaxError:
         return ""
-    tag2_pos1 = str.find("</" + tag, tag1_pos2)
-    if tag2_pos1 == -1:
+    user = root.find(CAS_NS + "authenticationSuccess/" + CAS_NS + "user")
+    if user is None or not user.text:
         return ""
-    return str[tag1_pos2 + 1: tag2_pos1].strip()
+    return user.text.strip()
 
 
 #  Split string in exactly two pieces, return '' for missing pieces.
@@ -82,36 +207,27 @@ def makehash(str):
 
 
 #  Validate ticket using cas 1.0 protocol
-def validate_cas_1(cas_host, service_url, ticket):
+def validate_cas_1(cas_host, service_url, ticket, opt=""):
     #  Second Call to CAS server: Ticket found, verify it.
-    cas_validate = cas_host + "/cas/validate?ticket=" + ticket + "&service=" + service_url
-    f_validate = urllib.urlopen(cas_validate)
-    #  Get first line - should be yes or no
-    response = f_validate.readline()
+    response = fetch_validation(
+        cas_host, "/cas/validate", service_url, ticket, opt)
+    #  First line should be yes or no, then the id
+    lines = (response or "").split("\n")
     #  Ticket does not validate, return error
-    if response == "no\n":
-        f_validate.close()
+    if lines[0].strip() != "yes" or len(lines) < 2 or not lines[1].strip():
         return TICKET_INVALID, ""
     #  Ticket validates
     else:
-        #  Get id
-        id = f_validate.readline()
-        f_validate.close()
-        id = id.strip()
-        return TICKET_OK, id
+        return TICKET_OK, lines[1].strip()
 
 
 #  Validate ticket using cas 2.0 protocol
 #    The 2.0 protocol allows the use of the mutually exclusive "renew" and "gateway" options.
-def validate_cas_2(cas_host, service_url, ticket, opt):
+def validate_cas_2(cas_host, service_url, ticket, opt=""):
     #  Second Call to CAS server: Ticket found, verify it.
-    cas_validate = cas_host + "/cas/serviceValidate?ticket=" + ticket + "&service=" + service_url
-    if opt:
-        cas_validate += "&%s=true" % opt
-    f_validate = urllib.urlopen(cas_validate)
-    #  Get first line - should be yes or no
-    response = f_validate.read()
-    id = parse_tag(response, "cas:user")
+    response = fetch_validation(
+        cas_host, "/cas/serviceValidate", service_url, ticket, opt)
+    id = parse_cas_2(response) if response else ""
     #  Ticket does not validate, return error
     if id == "":
         return TICKET_INVALID, ""
@@ -138,6 +254,8 @@ def get_cookie_status():
 def get_ticket_status(cas_host, service_url, protocol, opt):
     if request.args.get('ticket') is not None:
         ticket = request.args.get('ticket')
+        #  A ticket is validated by the CAS server every time, which
+        #  accepts it only once
         if protocol == 1:
             ticket_status, id = validate_cas_1(cas_host, service_url, ticket, opt)
         else:
@@ -9,7 +9,7 @@ from wtfpeewee.orm import model_form
 
 from models import *
 from db_ext import *
-from frame_ext import Converter, InstanceExist
+from frame_ext import Converter, InstanceExist, FormIntegerListField
 
 __all__ = [
     'UserForm',
@@ -26,6 +26,7 @@ __all__ = [
     'SiteSettingsForm',
     'ReserveForm',
     'SubmitUserForm',
+    'SubmitUserListForm',
     'RateForm',
     'VoteForm',
     'ApplyTicketForm',
@@ -61,6 +62,7 @@ UserForm = model_form(User, field_args={
     ])
 }, exclude=(
     'last_login', 'this_login', 'login_count', 'rfs_count', 'full_name',
+    'borrowed_cnt', 'reserved_cnt',
 ), converter=Converter())
 
 
@@ -319,6 +321,14 @@ class SubmitUserForm(Form):
     ])
 
 
+class SubmitUserListForm(Form):
+    """Used when there is need to submit a batch of users as input
+    """
+    ids = FormIntegerListField(u'ids', [
+        InputRequired(message="Users missing")
+    ])
+
+
 class RateForm(Form):
     """Used in rating system of VCD/DVD Library
     """
@@ -333,7 +343,6 @@ class VoteForm(Form):
     """
     film_id = f.IntegerField(u'rfs_id', [
         InputRequired(message="The film to vote missing"),
-        AnyOf([1, 2, 3], message="Invalid Choice")
     ])
 
 
@@ -1,8 +1,12 @@
+import base64
 import datetime
 import functools
 import flask_cas
+import hashlib
+import itertools
 import re
 import operator
+import time
 
 from werkzeug.datastructures import MultiDict
 from peewee import *
@@ -13,13 +17,16 @@ from wtforms.validators import StopValidation, ValidationError
 from wtforms.compat import string_types
 from wtfpeewee.orm import ModelConverter, FieldInfo, handle_null_filter
 from flask import request, g, json, jsonify, abort, url_for, redirect, session, Response
+from flask import stream_with_context
 from flask_peewee.auth import Auth
 from flask_peewee.rest import RestAPI, RestResource, Authentication
+from flask_peewee.utils import PaginatedQuery, get_object_or_404
 from flask_peewee.serializer import Serializer as pSer
 
 from app import app, db
 from helpers import after_this_request
-from db_ext import JSONField, SimpleListField
+from db_ext import JSONField, SimpleListField, Encoded
+from cache_ext import object_cache, model_changed
 
 __all__ = [
     'CASAuth',
@@ -29,7 +36,9 @@ __all__ = [
     'BaseAuthentication',
     'AdminAuthentication',
     'HookedResource',
-    'InstanceExist'
+    'merge_ordered',
+    'InstanceExist',
+    'FormIntegerListField',
     'Converter',
 ]
 
@@ -55,18 +64,33 @@ class CASAuth(Auth):
         return decorator
 
     def get_logged_in_user(self):
+        """Return the member logged in, or None
+
+        The member is resolved once per request, and kept in the object
+        cache across requests until the member changes. Set
+        OBJECT_CACHE_BACKEND when several processes serve the website,
+        otherwise a change made by one process shows in the others
+        after OBJECT_CACHE_TTL.
+        """
         if session.get('logged_in'):
             if getattr(g, 'user', None):
                 return g.user
+            if hasattr(g, 'session_user'):
+                return g.session_user
 
             try:
-                # only non-expired member can login
-                return self.User.select().where(
-                    self.User.member_type != 'Expired',
-                    self.User.id == session.get('user_pk')
-                ).get()
+                # kept in the shared backend only, so that a member
+                # changed by another process is seen at once
+                user = object_cache.fetch(self.User.select(),
+                    session.get('user_pk'), 'session', local=False)
             except self.User.DoesNotExist:
-                pass
+                user = None
+            # only non-expired member can login, checked on every
+            # request whatever is cached
+            if user is not None and user.member_type == 'Expired':
+                user = None
+            g.session_user = user
+            return user
 
     def login(self):
         """Look for ticket returned by CAS server and verify the ticket
@@ -91,7 +115,8 @@ class CASAuth(Auth):
                     self.login_user(user)
                     user.last_login = user.this_login
                     user.this_login = datetime.datetime.now()
-                    user.login_count = user.login_count + 1
+                    user.increment('login_count')
+                    # only the three columns are written
                     user.save()
                     # set cookie for cas auth
                     if cookie:
@@ -133,12 +158,57 @@ class CASAuth(Auth):
         session['logged_in'] = True
         session['user_pk'] = user.get_id()
         session.permanent = True
-        g.user = user
+        g.user = g.session_user = user
 
 
 class IterableModel(db.Model):
-    """This Model can look for its next primary key
+    """This Model can look for its next primary key. Changes through
+    save() and delete_instance() are notified to the caches
+
+    Fields assigned since the instance is loaded are tracked, and save()
+    of an existing instance only writes those, together with counters
+    changed by increment(). Lists and dicts may be modified in place, so
+    fields holding them are written unless their values are known to be
+    unchanged, e.g. never read since loaded.
+
+    The fields assigned are kept in _assigned of our own, as _dirty of
+    peewee misses foreign keys.
     """
+    def __setattr__(self, name, value):
+        if name in self._meta.fields:
+            self.__dict__.setdefault('_assigned', set()).add(name)
+        super(IterableModel, self).__setattr__(name, value)
+
+    def prepared(self):
+        """Called once the instance is loaded, nothing is dirty yet
+        """
+        self.__dict__['_assigned'] = set()
+        self.__dict__['_increments'] = {}
+
+    def get_dirty_fields(self):
+        """Return the names of the fields to write on save"""
+        dirty = set(self.__dict__.get('_assigned', ()))
+        for name, field in self._meta.fields.items():
+            if isinstance(field, (SimpleListField, JSONField)) and \
+                    not field.is_clean(self._data.get(name)):
+                dirty.add(name)
+        dirty.discard(self._meta.primary_key.name)
+        return dirty
+
+    def increment(self, name, delta=1):
+        """Add delta to a counter. It is written as name = name + delta
+        so that concurrent changes of the counter are not lost.
+
+        :param name:
+            The name of the field
+        :param delta:
+            The number to add
+        """
+        # not through the field, which would mark it assigned
+        self._data[name] = (getattr(self, name) or 0) + delta
+        increments = self.__dict__.setdefault('_increments', {})
+        increments[name] = increments.get(name, 0) + delta
+
     @classmethod
     def next_primary_key(cls):
         """Execute custom SQL to acquire next primary key
@@ -154,6 +224,49 @@ class IterableModel(db.Model):
         cursor.close()
         return row[0]
 
+    @classmethod
+    def estimate_count(cls):
+        """Return the number of rows estimated by the storage engine,
+        which is much cheaper than COUNT(*) on large tables
+        """
+        tb_name = cls._meta.db_table
+        cls_db = cls._meta.database
+        cursor = cls_db.execute_sql("SELECT `TABLE_ROWS` "
+                                    "FROM information_schema.`TABLES` "
+                                    "WHERE TABLE_SCHEMA = %s "
+                                    "AND TABLE_NAME = %s",
+                                    (cls_db.database, tb_name,))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0]
+
+    def save(self, force_insert=False, only=None):
+        """Insert a new instance, or update the columns changed of an
+        existing one
+        """
+        pk = self._meta.primary_key
+        if force_insert or only is not None or self.get_id() is None:
+            result = super(IterableModel, self).save(force_insert, only)
+        else:
+            values = dict((x, self._data.get(x))
+                            for x in self.get_dirty_fields())
+            for name, delta in self.__dict__.get('_increments', {}).items():
+                if name not in values:
+                    # an assigned value holds the increments already
+                    values[name] = self._meta.fields[name] + delta
+            result = 0
+            if values:
+                result = type(self).update(**values).where(
+                    pk == self.get_id()).execute()
+        self.prepared()
+        model_changed(type(self), self.get_id())
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super(IterableModel, self).delete_instance(*args, **kwargs)
+        model_changed(type(self), self.get_id())
+        return result
+
 
 class BusinessException(Exception):
     """Custom exception to be caught and send response directly
@@ -230,10 +343,15 @@ class Serializer(pSer):
     """Fix a tranversal error in flask-peweee
     """
     def clean_data(self, data):
+        # values of SimpleListField and JSONField not decoded yet
+        if isinstance(data, Encoded):
+            data = data.decode()
         # it is possible that data itself is not a dict
         if not isinstance(data, dict):
             return data
         for key, value in data.items():
+            if isinstance(value, Encoded):
+                value = data[key] = value.decode()
             if isinstance(value, dict):
                 self.clean_data(value)
             elif isinstance(value, (list, tuple)):
@@ -243,6 +361,118 @@ class Serializer(pSer):
         return data
 
 
+class CompiledSerializer(Serializer):
+    """Serialize instances of a model with a plan worked out once
+
+    The plan lists the fields to output together with how to convert
+    each of them, derived from the fields and exclude of a resource and
+    the types of the fields. Objects are then turned into the same
+    dicts as Serializer.serialize_object gives, without introspecting
+    every object and walking the result again.
+
+    :param model:
+        The model to serialize
+    :param fields:
+        A dict of model -> names of fields to output, as _fields of
+        RestResource
+    :param exclude:
+        A dict of model -> names of fields not to output, as _exclude
+        of RestResource
+    """
+    def __init__(self, model, fields, exclude, compiled=None):
+        # share plans of related models, also breaks cycles
+        compiled = {} if compiled is None else compiled
+        compiled[model] = self
+
+        self.model = model
+        self.plan = []
+        excluded = exclude.get(model, [])
+        for name in fields.get(model, model._meta.get_field_names()):
+            if name in excluded:
+                continue
+            field = model._meta.fields[name]
+            if isinstance(field, ForeignKeyField) and \
+                    field.rel_model in fields:
+                rel = (compiled.get(field.rel_model) or CompiledSerializer(
+                        field.rel_model, fields, exclude, compiled))
+                self.plan.append((name, None, rel))
+            else:
+                self.plan.append((name, self.get_converter(field), None))
+
+    def get_converter(self, field):
+        """Return the function converting values of a field, or None
+        if the values are output as they are
+        """
+        if isinstance(field, (DateTimeField, DateField, TimeField)):
+            return self.convert_value
+        if isinstance(field, (SimpleListField, JSONField)):
+            return self.clean_data
+        return None
+
+    def is_flat(self):
+        """Return whether no related object is nested in the output"""
+        return all(rel is None for name, convert, rel in self.plan)
+
+    def serialize_object(self, obj, fields=None, exclude=None):
+        """Return the dict of an object
+
+        :param obj:
+            The object to serialize
+        """
+        data = {}
+        values = obj._data
+        for name, convert, rel in self.plan:
+            value = values.get(name)
+            if isinstance(value, Encoded):
+                # decoded once and kept, as on reading the attribute
+                value = values[name] = value.decode()
+            if rel is not None and value:
+                data[name] = rel.serialize_object(getattr(obj, name))
+            elif convert is None:
+                data[name] = value
+            else:
+                data[name] = convert(value)
+        return data
+
+    def serialize_tuples(self, query):
+        """Yield the dicts of rows selected by query as raw tuples,
+        without creating model instances. Only for flat plans.
+
+        :param query:
+            The query selecting the rows
+        """
+        fields = query.model_class._meta.fields
+        names = [name for name, convert, rel in self.plan]
+        converters = [convert for name, convert, rel in self.plan]
+        for row in query.select(*[fields[x] for x in names]).tuples():
+            yield dict(zip(names, [x if convert is None else convert(x)
+                                    for x, convert in zip(row, converters)]))
+
+
+def merge_ordered(lists, ordering, limit=None):
+    """Merge lists of instances, each sorted by ordering, into a list
+    sorted by ordering. The instances may be of different models having
+    the fields of ordering.
+
+    :param lists:
+        The sorted lists of instances
+    :param ordering:
+        A list of (name of field, descending)
+    :param limit:
+        The number of instances to return at most, or None for all
+    """
+    def compare(a, b):
+        for name, desc in ordering:
+            x, y = a._data.get(name), b._data.get(name)
+            result = cmp(y, x) if desc else cmp(x, y)
+            if result:
+                return result
+        return 0
+
+    result = sorted(itertools.chain(*lists), cmp=compare)
+    return result if limit is None else result[:limit]
+
+
 class HookedResource(RestResource):
     """Extend RestResource to have more hook and make it searchable
     """
@@ -260,29 +490,65 @@ class HookedResource(RestResource):
     # the form of validation
     validate_form = None
 
+    # foreign keys to resolve through the object cache on detail
+    cached_relations = None
+
+    # default ordering of cursor pagination, the primary key is always
+    # appended to break ties
+    cursor_ordering = ('-id',)
+
+    # serialize list pages from raw tuples, only takes effect if no
+    # related object is nested and prepare_data is not overridden
+    serialize_tuples = False
+
+    # Cache-Control of GET responses, None not to send validators.
+    # Responses of resources with a version answer If-None-Match and
+    # If-Modified-Since with 304
+    cache_control = None
+
+    # whether responses differ from member to member, the versions are
+    # then kept apart for each member
+    vary_by_user = False
+
     def __init__(self, *args, **kwargs):
         super(HookedResource, self).__init__(*args, **kwargs)
 
         self._readonly = self.readonly or []
         self._search = self.search or {'default': []}
         self._search['default'] = self._search['default'] or []
+        self._serializer = None
 
 
-    def data_precheck(self, data, formclass):
-        """Precheck the validity of JSON data using form supplied
+    def parse_json_object(self, data):
+        """Parse raw data as a JSON object, or respond with 400
 
         :param data:
             Raw data supplied
-        :param formclass:
-            The form to check against
         """
         try:
             data = json.loads(data)
         except ValueError:
+            data = None
+        if not isinstance(data, dict):
             raise BusinessException(
                 "Invalid JSON", self.response_bad_request())
+        return data
+
+    def data_precheck(self, data, formclass):
+        """Precheck the validity of JSON data using form supplied
+
+        :param data:
+            Raw data supplied, or the dict parsed from it
+        :param formclass:
+            The form to check against
+        """
+        if not isinstance(data, dict):
+            data = self.parse_json_object(data)
         # do validation first
         form = formclass(MultiDict(data))
+        # look up the instances referred to together, and keep them for
+        # the handler
+        g.form_instances = InstanceExist.prefetch(form)
         if not form.validate():
             error = ' | '.join(
                 [', '.join(x) for x in form.errors.values()])
@@ -328,22 +594,88 @@ class HookedResource(RestResource):
         """
         ordering = request.args.get('ordering') or ''
         if ordering:
+            # the query may select from a model other than self.model
+            fields = query.model_class._meta.fields
             order_list = []
             for keyword in ordering.split(','):
                 desc, column = keyword.startswith('-'), keyword.lstrip('-')
-                if column in self.model._meta.fields:
-                    field = self.model._meta.fields[column]
+                if column in fields:
+                    field = fields[column]
                     order_list.append(
                         field.asc() if not desc else field.desc())
             query = query.order_by(*order_list)
 
         return query
 
+    def get_object(self, pk, fresh=False):
+        """Return the instance visible to the current user or abort 404
+
+        Instances are served from the object cache. The query differs
+        for admins, so they are cached in a scope of their own. A cached
+        instance may be stale, so the instances to change and check the
+        state of are loaded fresh instead.
+
+        :param pk:
+            The primary key of the instance
+        :param fresh:
+            Whether to load the instance from the database
+        """
+        if fresh:
+            return get_object_or_404(self.get_query(), self.pk == pk)
+        scope = 'admin' if (g.user and g.user.admin) else 'public'
+        try:
+            obj = object_cache.fetch(self.get_query(), pk, scope)
+            for name in self.cached_relations or []:
+                field = self.model._meta.fields[name]
+                if obj._data.get(name) is not None:
+                    setattr(obj, name, object_cache.fetch(
+                        field.rel_model.select(), obj._data[name]))
+            return obj
+        except DoesNotExist:
+            abort(404)
+
+    def api_detail(self, pk, method=None):
+        """Look up the instance through the object cache, for GET only
+        """
+        method = method or request.method
+        obj = self.get_object(pk, fresh=(method != 'GET'))
+
+        if not getattr(self, 'check_%s' % method.lower())(obj):
+            return self.response_forbidden()
+
+        if method == 'GET':
+            return self.conditional_response(
+                functools.partial(self.object_detail, obj))
+        elif method in ('PUT', 'POST'):
+            return self.edit(obj)
+        elif method == 'DELETE':
+            return self.delete(obj)
+
     def get_serializer(self):
         """Replace the original one by the custom one
         """
         return Serializer()
 
+    def get_compiled_serializer(self):
+        """Return the serializer compiled for this resource
+        """
+        if self._serializer is None:
+            self._serializer = CompiledSerializer(
+                self.model, self._fields, self._exclude)
+        return self._serializer
+
+    def serialize_object(self, obj):
+        """Serialize with the compiled serializer
+        """
+        return self.prepare_data(
+            obj, self.get_compiled_serializer().serialize_object(obj))
+
+    def can_serialize_tuples(self):
+        """Return whether list pages can be serialized from tuples"""
+        return (self.serialize_tuples and
+                self.get_compiled_serializer().is_flat() and
+                self.prepare_data.im_func is RestResource.prepare_data.im_func)
+
     def before_send(self, data):
         """Append 0 errno to indicate success
         """
@@ -351,14 +683,125 @@ class HookedResource(RestResource):
         data['error'] = ''
         return data
 
+    def get_json_kwargs(self):
+        """Give dense output unless ?pretty=1 is set
+        """
+        if request.args.get('pretty') == '1':
+            return {'indent': 2}
+        return {'separators': (',', ':')}
+
     def response(self, data):
-        """Give dense output when is_xhr is set
+        """Serialize data to JSON
         """
-        kwargs = {'separators': (',', ':')} if request.is_xhr else {'indent': 2}
         return Response(
-            json.dumps(self.before_send(data), **kwargs),
+            json.dumps(self.before_send(data), **self.get_json_kwargs()),
             mimetype='application/json')
 
+    def stream_response(self, meta, objects):
+        """Serialize a list of objects to JSON one by one while sending
+        the response, so that only one object is held in memory at a
+        time however many are returned
+
+        :param meta:
+            The metadata of the list
+        :param objects:
+            An iterable of the objects to serialize, or of the dicts
+            serialized already
+        """
+        kwargs = self.get_json_kwargs()
+        data = self.before_send({'meta': meta})
+
+        def generate():
+            # the objects come last, leave the envelope open for them
+            yield json.dumps(data, **kwargs)[:-1].rstrip()
+            yield ',"objects":['
+            for i, obj in enumerate(objects):
+                if i:
+                    yield ','
+                if not isinstance(obj, dict):
+                    obj = self.serialize_object(obj)
+                yield json.dumps(obj, **kwargs)
+            yield ']}'
+
+        return Response(
+            stream_with_context(generate()), mimetype='application/json')
+
+    def get_version(self):
+        """Return (token, last modified time) of the data of the
+        resource, or None if unknown. The token must change whenever
+        the data changes.
+        """
+        return None
+
+    def get_etag(self, token):
+        """Return the ETag of the response to the current request
+
+        :param token:
+            The version token of the resource
+        """
+        if self.vary_by_user:
+            viewer = g.user.id if g.user else None
+        else:
+            # admins may see more, e.g. drafts
+            viewer = bool(g.user and g.user.admin)
+        return hashlib.md5(
+            repr((token, request.full_path, viewer))).hexdigest()
+
+    def conditional_response(self, make_response):
+        """Answer a GET with 304 if the client holds the current version
+        of the data, otherwise return make_response() with validators
+
+        :param make_response:
+            The function building the full response
+        """
+        version = self.cache_control and self.get_version()
+        if not version:
+            return make_response()
+        token, modified = version
+        etag = self.get_etag(token)
+        if modified is not None:
+            # Last-Modified is in GMT while the times are local
+            modified = datetime.datetime.utcfromtimestamp(
+                time.mktime(modified.timetuple()))
+
+        if request.if_none_match:
+            fresh = etag in request.if_none_match
+        else:
+            # the date says nothing about who the response is for
+            fresh = (not self.vary_by_user and modified is not None and
+                     request.if_modified_since is not None and
+                     modified <= request.if_modified_since)
+
+        response = Response(status=304) if fresh else make_response()
+        response.set_etag(etag)
+        if modified is not None:
+            response.last_modified = modified
+        response.headers['Cache-Control'] = self.cache_control
+        if self.vary_by_user:
+            response.vary.add('Cookie')
+        return response
+
+    def random_response(self, pool):
+        """Return the response of an instance picked at random, or of a
+        list of ?n= distinct instances
+
+        :param pool:
+            The RandomPool to pick from
+        """
+        try:
+            n = int(request.args.get('n', 0))
+        except ValueError:
+            n = 0
+        limit = app.config.get('RANDOM_SAMPLE_MAX', 20)
+        objects = pool.sample(min(max(n, 1), limit))
+        if not n:
+            if not objects:
+                abort(404)
+            return self.object_detail(objects[0])
+        return self.response({
+            'objects': [self.serialize_object(x) for x in objects]
+        })
+
     def get_urls(self):
         """Add a search endpoint in addition to the original ones
         """
@@ -389,6 +832,38 @@ class HookedResource(RestResource):
             return data
         return self.data_precheck(data, self.validate_form)
 
+    def get_instance(self, model, pk):
+        """Return an instance referred to by the data validated, which
+        is loaded on validation already. Other instances are looked up.
+
+        :param model:
+            The model of the instance
+        :param pk:
+            The primary key of the instance
+        """
+        instance = getattr(g, 'form_instances', {}).get((model, pk))
+        if instance is None:
+            instance = model.select().where(
+                model._meta.primary_key == pk).get()
+        return instance
+
+    def attach_instances(self, instance):
+        """Resolve the foreign keys of an instance to the instances
+        loaded on validation, so they are not fetched again
+
+        :param instance:
+            The instance to be saved
+        """
+        found = getattr(g, 'form_instances', None)
+        if not found:
+            return instance
+        for name, field in instance._meta.fields.items():
+            if isinstance(field, ForeignKeyField):
+                rel = found.get((field.rel_model, instance._data.get(name)))
+                if rel is not None:
+                    setattr(instance, name, rel)
+        return instance
+
     def before_save(self, instance):
         """A hook before saving the instance
         """
@@ -404,24 +879,29 @@ class HookedResource(RestResource):
         This version omits the route prefix of API as it is designed
         to be handled by client. Also a total page field is added
         """
-        var = paginated_query.page_var
+        return self.get_page_metadata(
+            paginated_query.get_page(), paginated_query.get_pages(),
+            paginated_query.page_var)
+
+    def get_page_metadata(self, current_page, total_page, var='page'):
+        """Return metadata of a page of the current list
+
+        :param current_page:
+            The number of the page
+        :param total_page:
+            The number of pages
+        :param var:
+            The argument giving the page number
+        """
         request_arguments = request.args.copy()
-
-        current_page = paginated_query.get_page()
-        total_page = paginated_query.get_pages()
         next = previous = ''
 
-        regex = re.compile('^.*?/%s' % self.get_api_name())
         if current_page > 1:
             request_arguments[var] = current_page - 1
-            previous = url_for(
-                self.get_url_name(g.list_callback), **request_arguments)
-            previous = regex.sub('', previous)
+            previous = self.get_list_url(request_arguments)
         if current_page < total_page:
             request_arguments[var] = current_page + 1
-            next = url_for(
-                self.get_url_name(g.list_callback), **request_arguments)
-            next = regex.sub('', next)
+            next = self.get_list_url(request_arguments)
 
         return {
             'model': self.get_api_name(),
@@ -431,6 +911,151 @@ class HookedResource(RestResource):
             'next': next,
         }
 
+    def get_list_url(self, request_arguments):
+        """Return the URL of the current list with other arguments,
+        without the route prefix of API
+
+        :param request_arguments:
+            The arguments of the URL
+        """
+        regex = re.compile('^.*?/%s' % self.get_api_name())
+        return regex.sub('', url_for(
+            self.get_url_name(g.list_callback), **request_arguments))
+
+    def get_page_size(self):
+        """Return the number of objects on a page"""
+        try:
+            paginate_by = int(request.args.get('limit', self.paginate_by))
+        except ValueError:
+            paginate_by = self.paginate_by
+        if self.paginate_by:
+            paginate_by = min(paginate_by, self.paginate_by)
+        return paginate_by
+
+    def paginated_object_list(self, filtered_query):
+        """Use cursor pagination if ?cursor= is present. Objects are
+        streamed in either case
+        """
+        if 'cursor' in request.args:
+            return self.cursor_object_list(filtered_query)
+
+        paginated_query = PaginatedQuery(filtered_query, self.get_page_size())
+        if self.can_serialize_tuples():
+            objects = self.get_compiled_serializer().serialize_tuples(
+                paginated_query.get_list())
+        else:
+            objects = paginated_query.get_list().iterator()
+        return self.stream_response(
+            self.get_request_metadata(paginated_query), objects)
+
+    def get_cursor_ordering(self, model):
+        """Return a list of (field, descending) that cursor pages are
+        ordered by. It always ends with the primary key.
+
+        :param model:
+            The model queried
+        """
+        ordering = (request.args.get('ordering') or
+                    ','.join(self.cursor_ordering))
+        fields = model._meta.fields
+        pk = model._meta.primary_key
+        order_list = []
+        for keyword in ordering.split(','):
+            desc, column = keyword.startswith('-'), keyword.lstrip('-')
+            if column in fields:
+                order_list.append((fields[column], desc))
+                if fields[column] is pk:
+                    # unique already
+                    return order_list
+        order_list.append((pk, True))
+        return order_list
+
+    def keyset_predicate(self, ordering, values):
+        """Return the expression selecting rows after the keys
+
+        For ordering a, -b, id it is:
+            (a > x) OR (a = x AND b < y) OR (a = x AND b = y AND id > z)
+
+        :param ordering:
+            The list of (field, descending) from get_cursor_ordering
+        :param values:
+            The values of the fields in the last row of previous page
+        """
+        clauses = []
+        for i, (field, desc) in enumerate(ordering):
+            clause = [x[0] == v for x, v in zip(ordering[:i], values[:i])]
+            clause.append(field < values[i] if desc else field > values[i])
+            clauses.append(reduce(operator.and_, clause))
+        return reduce(operator.or_, clauses)
+
+    def encode_cursor(self, obj, ordering):
+        """Return an opaque cursor pointing after obj"""
+        values = [obj._data.get(field.name) for field, desc in ordering]
+        return base64.urlsafe_b64encode(json.dumps(values, default=unicode))
+
+    def decode_cursor(self, cursor, ordering):
+        """Return the values encoded in a cursor"""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        except (TypeError, ValueError):
+            raise BusinessException("Invalid cursor", 1)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise BusinessException("Invalid cursor", 1)
+        return values
+
+    def get_total(self, query):
+        """Return the total number of objects as ?count= asks
+
+        exact: COUNT(*) of the query
+        estimate: the rows of the table estimated by MySQL, regardless
+            of filters
+        otherwise: None, skip counting
+
+        :param query:
+            The filtered query
+        """
+        count = request.args.get('count')
+        if count == 'exact':
+            return query.count()
+        elif count == 'estimate':
+            return query.model_class.estimate_count()
+        return None
+
+    def cursor_object_list(self, filtered_query):
+        """Return a page selected by keys of the last row of previous
+        page instead of LIMIT/OFFSET, so that every page costs the same
+
+        :param filtered_query:
+            The query to paginate
+        """
+        ordering = self.get_cursor_ordering(filtered_query.model_class)
+        query = filtered_query.order_by(
+            *[x.desc() if desc else x.asc() for x, desc in ordering])
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            values = self.decode_cursor(cursor, ordering)
+            query = query.where(self.keyset_predicate(ordering, values))
+
+        # fetch one more to know whether there is a next page
+        paginate_by = self.get_page_size()
+        objects = list(query.limit(paginate_by + 1))
+
+        next = ''
+        if len(objects) > paginate_by:
+            objects = objects[:paginate_by]
+            request_arguments = request.args.copy()
+            request_arguments['cursor'] = self.encode_cursor(
+                objects[-1], ordering)
+            next = self.get_list_url(request_arguments)
+
+        return self.stream_response({
+            'model': self.get_api_name(),
+            'cursor': cursor or '',
+            'total': self.get_total(filtered_query),
+            'next': next,
+        }, objects)
+
     def create(self):
         """Create a new model instance
         """
@@ -439,6 +1064,7 @@ class HookedResource(RestResource):
         data = self.validate_data(data)
 
         instance, models = self.deserialize_object(data, self.model())
+        instance = self.attach_instances(instance)
 
         instance = self.before_save(instance)
         self.save_related_objects(instance, data)
@@ -459,6 +1085,7 @@ class HookedResource(RestResource):
             data.pop(key, None)
 
         obj, models = self.deserialize_object(data, obj)
+        obj = self.attach_instances(obj)
 
         obj = self.before_save(obj)
         self.save_related_objects(obj, data)
@@ -477,6 +1104,17 @@ class HookedResource(RestResource):
         self.after_save()
         return self.response({'deleted': res})
 
+    def apply_search_engine(self, query, engine, terms):
+        """Append the filter of a search engine other than default.
+        Resources may override it to search through an index.
+
+        :param engine:
+            The name of the engine
+        :param terms:
+            The terms input by users for searching
+        """
+        return self.apply_search_query(query, terms, self._search[engine])
+
     def apply_search_query(self, query, terms, fields):
         """Append the search filter to the query
 
@@ -503,6 +1141,9 @@ class HookedResource(RestResource):
 
     def api_list(self):
         g.list_callback = 'api_list'
+        if request.method == 'GET' and self.check_get():
+            return self.conditional_response(
+                super(HookedResource, self).api_list)
         return super(HookedResource, self).api_list()
 
     def api_search(self):
@@ -520,16 +1161,31 @@ class HookedResource(RestResource):
         if not getattr(self, 'check_%s' % request.method.lower())():
             return self.response_forbidden()
 
+        return self.conditional_response(self.search_object_list)
+
+    def search_object_list(self):
+        """Return the response of the search in the request
+        """
+        # construct a raw query
+        query = self.get_query()
+        query = self.apply_ordering(query)
+        query = self.apply_search(query)
+
+        # apply output limit 
+        if self.paginate_by or 'limit' in request.args:
+            return self.paginated_object_list(query)
+
+        return self.response(self.serialize_query(query))
+
+    def apply_search(self, query):
+        """Append the filters of the search in the request to the query
+        """
         # terms to search for
         search_term = request.args.get('query') or ''
 
         # the engine to use
         engine = request.args.get('engine') or ''
 
-        # construct a raw query
-        query = self.get_query()
-        query = self.apply_ordering(query)
-
         if engine == 'default':
             # search in default fields
 
@@ -570,14 +1226,10 @@ class HookedResource(RestResource):
                 kw_set = set(kws)
                 kw_set.discard('')
                 if kw_set and self._search.get(engine, []):
-                    query = self.apply_search_query(
-                        query, list(kw_set), self._search[engine])
+                    query = self.apply_search_engine(
+                        query, engine, list(kw_set))
 
-        # apply output limit 
-        if self.paginate_by or 'limit' in request.args:
-            return self.paginated_object_list(query)
-
-        return self.response(self.serialize_query(query))
+        return query
 
 
 class NullableOptional(validators.Optional):
@@ -596,6 +1248,10 @@ class InstanceExist(object):
     """
     Check the existence of a foreignkey field.
 
+    If prefetch() is called on the form before validation, the checks
+    of the whole form are answered by its result instead of one query
+    each.
+
     :param model:
         The model to check.
     :param message:
@@ -606,8 +1262,49 @@ class InstanceExist(object):
         self.pk = model._meta.primary_key
         self.message = message
 
+    @staticmethod
+    def prefetch(form):
+        """Look up the instances referred to by all the fields of a form
+        checked by InstanceExist, with one query per model
+
+        Return a dict of (model, primary key) -> instance found, which
+        is also kept in the form for the validators.
+
+        :param form:
+            The form to be validated
+        """
+        wanted = set()
+        for field in form:
+            for validator in field.validators:
+                if not isinstance(validator, InstanceExist):
+                    continue
+                try:
+                    wanted.add((validator.model, int(field.data)))
+                except (TypeError, ValueError):
+                    # left to the validator
+                    pass
+
+        found = {}
+        for model in set(x[0] for x in wanted):
+            pks = [x[1] for x in wanted if x[0] is model]
+            for obj in model.select().where(model._meta.primary_key << pks):
+                found[(model, obj.get_id())] = obj
+        form.instances_wanted = wanted
+        form.instances_found = found
+        return found
+
+    def exists(self, form, field):
+        """Return whether the instance referred to by field exists"""
+        try:
+            key = (self.model, int(field.data))
+        except (TypeError, ValueError):
+            key = None
+        if key in getattr(form, 'instances_wanted', ()):
+            return key in form.instances_found
+        return self.model.select().where(self.pk == field.data).exists()
+
     def __call__(self, form, field):
-        if not self.model.select().where(self.pk == field.data).exists():
+        if not self.exists(form, field):
             if self.message is None:
                 self.message = field.gettext('The instance referred to not exist')
 
@@ -629,6 +1326,20 @@ class FormIntegerField(f.IntegerField):
                 raise ValueError(self.gettext('Not a valid integer'))
 
 
+class FormIntegerListField(f.Field):
+    """A list of integers submitted as a JSON array
+    """
+    def _value(self):
+        return ','.join(str(x) for x in self.data or [])
+
+    def process_formdata(self, valuelist):
+        try:
+            self.data = [int(x) for x in valuelist]
+        except (ValueError, TypeError):
+            self.data = None
+            raise ValueError(self.gettext('Not a valid list of integers'))
+
+
 class FormDateTimeField(f.DateTimeField):
     """Catch TypeError
     """
@@ -1,6 +1,7 @@
 from math import sqrt
-from ftplib import FTP
+import hashlib
 import smtplib
+import tempfile
 import ldap
 from ldap.filter import escape_filter_chars
 from email.mime.multipart import MIMEMultipart
@@ -10,6 +11,7 @@ from email.utils import COMMASPACE, formatdate
 from flask import g
 import sympa
 from app import app
+from storage import storage, UPLOAD_DIR
 
 __all__ = [
     'after_this_request',
@@ -129,19 +131,35 @@ def update_mailing_list(new_list):
     sympa_mgmt.replace_email(app.config['MAILING_LIST'], member_list)
 
 
+def spool_upload(file_handler, chunk_size=65536):
+    """Copy an upload to a temporary file while hashing it
+
+    Return (SHA-1 hex digest of the content, the temporary file rewound)
+
+    :param file_handler:
+        The stream of the upload
+    :param chunk_size:
+        The number of bytes read at a time
+    """
+    digest = hashlib.sha1()
+    spool = tempfile.SpooledTemporaryFile(
+        max_size=app.config.get('UPLOAD_SPOOL_SIZE', 1024 * 1024))
+    for chunk in iter(lambda: file_handler.read(chunk_size), ''):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return digest.hexdigest(), spool
+
+
 def upload_file(filename, file_handler):
-    """Upload a file to FTP server
+    """Upload a file to the storage
 
     :param filename:
-        The name to be stored in FTP
+        The name to be stored in the upload directory
     :param file_handler:
         The file to be uploaded
     """
-    conn = FTP('ihome.ust.hk', app.config['SOCIETY_USERNAME'],
-                app.config['SOCIETY_PASSWORD'])
-    conn.cwd('/asset/upload')
-    conn.storbinary("STOR " + filename, file_handler)
-    conn.quit()
+    storage.store(UPLOAD_DIR + filename, file_handler)
 
 
 def send_email(receiver, bcc, subject, body):
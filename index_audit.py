@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# A little script to replay a workload against the website and check
+# the queries it issues with EXPLAIN. Queries scanning whole tables or
+# sorting in a file are reported with the columns an index could cover,
+# and so are the indexes declared in models but missing in the database.
+#
+# Usage: python index_audit.py [workload file] [--apply]
+#
+# Each line of a workload file is a path to GET, or "as <user ID>" to
+# send the following requests as that member ("as" alone for a guest).
+# With --apply the missing indexes are added through migrate.py.
+
+import re
+import socket
+import sys
+from collections import OrderedDict
+
+from app import app, db
+import filmsoc
+import migrate
+
+# used when no workload file is given
+default_workload = [
+    '/static/',
+    '/static/library/',
+    '/static/library/?mode=popular',
+    '/static/library/?mode=rank',
+    '/static/show/',
+    '/static/ticket/',
+    '/api/disk/?ordering=-id',
+    '/api/disk/?avail_type=Available',
+    '/api/disk/search/?query=love&engine=default',
+    '/api/regularfilmshow/',
+    '/api/previewshowticket/?state=Open',
+    '/api/news/',
+    '/api/document/',
+    '/api/publication/?pub_type=Magazine',
+    '/api/sponsor/',
+    '/api/exco/',
+    '/api/onesentence/rand/',
+]
+
+
+class QueryRecorder(object):
+    """Record the SELECT statements executed through a database while
+    in a with block
+
+    :param database:
+        The peewee database to watch
+    """
+    def __init__(self, database):
+        self.database = database
+        # sql -> (params of the first execution, times executed)
+        self.queries = OrderedDict()
+
+    def __enter__(self):
+        execute_sql = self.database.execute_sql
+
+        def record(sql, params=None, *args, **kwargs):
+            if sql.lstrip().upper().startswith('SELECT'):
+                entry = self.queries.get(sql)
+                self.queries[sql] = (
+                    params if entry is None else entry[0],
+                    1 if entry is None else entry[1] + 1)
+            return execute_sql(sql, params, *args, **kwargs)
+
+        self.database.execute_sql = record
+        return self
+
+    def __exit__(self, *exc_info):
+        del self.database.execute_sql
+
+
+def replay(lines):
+    """Send the requests of a workload
+
+    :param lines:
+        The lines of the workload
+    """
+    client = app.test_client()
+    environ = {
+        'REMOTE_ADDR': socket.gethostbyname(
+            app.config['FRONT_SERVER_HOST']),
+        'HTTP_REFERER': app.config['FRONT_SERVER'],
+    }
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.split()[0] == 'as':
+            user_id = line.split()[1:]
+            with client.session_transaction() as sess:
+                sess.clear()
+                if user_id:
+                    sess['logged_in'] = True
+                    sess['user_pk'] = int(user_id[0])
+            continue
+        response = client.get(line, environ_base=environ)
+        print "%d %s" % (response.status_code, line)
+
+
+def explain(sql, params):
+    """Return the rows of EXPLAIN of a query as dicts"""
+    cursor = db.database.execute_sql('EXPLAIN ' + sql, params)
+    names = [x[0] for x in cursor.description]
+    rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+
+def suggest_columns(sql, table):
+    """Return the columns of a table filtered and then sorted on by a
+    query, in order, as a candidate index
+    """
+    aliases = dict((alias, name) for name, alias in re.findall(
+        r'`(\w+)` AS `?(\w+)`?', sql))
+    columns = []
+    for clause in re.findall(
+            r' (?:WHERE|ORDER BY) (.*?)(?= GROUP BY | ORDER BY | LIMIT |$)',
+            sql):
+        for alias, column in re.findall(r'`?(\w+)`?\.`(\w+)`', clause):
+            if aliases.get(alias, alias) == table and \
+                    column not in columns:
+                columns.append(column)
+    return columns
+
+
+def audit(queries):
+    """Print the queries scanning whole tables or sorting in a file"""
+    problems = 0
+    for sql, (params, times) in queries.items():
+        for row in explain(sql, params):
+            extra = row.get('Extra') or ''
+            issues = []
+            if row.get('type') == 'ALL':
+                issues.append('full scan')
+            if 'Using filesort' in extra:
+                issues.append('filesort')
+            if not issues:
+                continue
+            problems += 1
+            table = row.get('table')
+            # EXPLAIN names the table by its alias
+            match = re.search(r'`(\w+)` AS `?%s`?' % table, sql)
+            table = match.group(1) if match else table
+            print "%s on %s, executed %d times, ~%s rows" % (
+                ' and '.join(issues), table, times, row.get('rows'))
+            print "  %s" % sql
+            columns = suggest_columns(sql, table)
+            if columns:
+                print "  candidate index: (%s)" % ', '.join(columns)
+    return problems
+
+
+def main():
+    args = sys.argv[1:]
+    apply_indexes = '--apply' in args
+    args = [x for x in args if x != '--apply']
+    if args:
+        with open(args[0]) as f:
+            lines = f.readlines()
+    else:
+        lines = default_workload
+
+    with QueryRecorder(db.database) as recorder:
+        replay(lines)
+
+    print
+    print "%d distinct queries" % len(recorder.queries)
+    audit(recorder.queries)
+
+    print
+    missing = migrate.missing_indexes()
+    for model, fields, unique in missing:
+        print "missing %sindex %s" % (
+            'unique ' if unique else '', migrate.index_name(model, fields))
+    if missing and apply_indexes:
+        migrate.model_indexes()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+# A little script to move logs older than LOG_ARCHIVE_DAYS days to the
+# archive table of the year they were created in.
+# The script should be set up as a scheduled task.
+
+from app import app
+from models import *
+
+# logs still in use by the business are never archived:
+# create logs are referred to by create_log of models,
+# rate logs are counted for the ranks of disks
+KEEP_TYPES = app.config.get('LOG_ARCHIVE_KEEP', ['create', 'rate'])
+
+# the number of logs moved in a transaction
+BATCH_SIZE = app.config.get('LOG_ARCHIVE_BATCH', 1000)
+
+
+def archive_batch(horizon):
+    """Move a batch of cold logs to the archive
+
+    Return the number of logs moved
+
+    :param horizon:
+        Logs created before this time are moved
+    """
+    database = Log._meta.database
+    cursor = database.execute_sql(
+        "SELECT `id`, YEAR(`created_at`) FROM `log` "
+        "WHERE `created_at` < %%s AND `log_type` NOT IN (%s) "
+        "ORDER BY `id` LIMIT %%s" % ', '.join(['%s'] * len(KEEP_TYPES)),
+        [horizon] + list(KEEP_TYPES) + [BATCH_SIZE])
+    rows = cursor.fetchall()
+    cursor.close()
+
+    # named rather than *, so the copy does not depend on the order of
+    # the columns in the tables
+    columns = ', '.join(
+        '`%s`' % x.db_column for x in Log._meta.get_fields())
+
+    years = {}
+    for log_id, year in rows:
+        years.setdefault(year, []).append(log_id)
+
+    with database.transaction():
+        for year, ids in years.items():
+            table = get_log_archive(year)._meta.db_table
+            database.execute_sql(
+                "CREATE TABLE IF NOT EXISTS `%s` LIKE `log`" % table)
+            id_list = ', '.join(str(x) for x in ids)
+            database.execute_sql(
+                "INSERT INTO `%s` (%s) SELECT %s FROM `log` "
+                "WHERE `id` IN (%s)" % (table, columns, columns, id_list))
+            database.execute_sql(
+                "DELETE FROM `log` WHERE `id` IN (%s)" % id_list)
+    return len(rows)
+
+
+def main():
+    """Move cold logs batch by batch until none is left"""
+    horizon = Log.archive_horizon()
+    while archive_batch(horizon) == BATCH_SIZE:
+        pass
+
+if __name__ == '__main__':
+    main()
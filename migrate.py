@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# A little script to bring the database of an existing installation up
+# to date with the models. Fresh installations use create_tables().
+# Every step checks the current schema first, so the script is safe to
+# run more than once.
+
+from peewee import fn
+
+from models import *
+from models import sync_names
+import reconcile
+
+
+def column_exists(model, column):
+    """Return whether a column exists in the table of a model
+
+    :param model:
+        The model to check
+    :param column:
+        The name of the column
+    """
+    cls_db = model._meta.database
+    cursor = cls_db.execute_sql("SELECT COUNT(*) "
+                                "FROM information_schema.`COLUMNS` "
+                                "WHERE TABLE_SCHEMA = %s "
+                                "AND TABLE_NAME = %s "
+                                "AND COLUMN_NAME = %s",
+                                (cls_db.database, model._meta.db_table,
+                                    column,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] > 0
+
+
+def index_exists(model, name):
+    """Return whether an index exists on the table of a model
+
+    :param model:
+        The model to check
+    :param name:
+        The name of the index
+    """
+    cls_db = model._meta.database
+    cursor = cls_db.execute_sql("SELECT COUNT(*) "
+                                "FROM information_schema.`STATISTICS` "
+                                "WHERE TABLE_SCHEMA = %s "
+                                "AND TABLE_NAME = %s "
+                                "AND INDEX_NAME = %s",
+                                (cls_db.database, model._meta.db_table,
+                                    name,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] > 0
+
+
+def add_column(model, column, definition):
+    """Add a column to the table of a model if it is missing
+
+    Return whether the column is added.
+
+    :param model:
+        The model to alter
+    :param column:
+        The name of the column
+    :param definition:
+        The SQL definition of the column
+    """
+    if column_exists(model, column):
+        return False
+    model._meta.database.execute_sql(
+        "ALTER TABLE `%s` ADD COLUMN `%s` %s" %
+        (model._meta.db_table, column, definition))
+    return True
+
+
+def add_index(model, name, columns, unique=False):
+    """Add an index to the table of a model if it is missing
+
+    Return whether the index is added.
+
+    :param model:
+        The model to alter
+    :param name:
+        The name of the index
+    :param columns:
+        A list of the indexed columns
+    :param unique:
+        Whether the index is unique
+    """
+    if index_exists(model, name):
+        return False
+    model._meta.database.execute_sql(
+        "CREATE %sINDEX `%s` ON `%s` (%s)" %
+        ('UNIQUE ' if unique else '', name, model._meta.db_table,
+            ', '.join('`%s`' % x for x in columns)))
+    return True
+
+
+def index_name(model, fields):
+    """Return the name peewee gives to an index of fields of a model
+
+    :param model:
+        The model of the index
+    :param fields:
+        A list of the names of the indexed fields
+    """
+    return '%s_%s' % (model._meta.db_table, '_'.join(
+        model._meta.fields[x].db_column for x in fields))
+
+
+def missing_indexes():
+    """Return a list of (model, fields, unique) of the indexes declared
+    in models but missing in the database
+    """
+    result = []
+    for model in all_models:
+        if not model.table_exists():
+            continue
+        for fields, unique in model._meta.indexes:
+            if not index_exists(model, index_name(model, fields)):
+                result.append((model, fields, unique))
+    return result
+
+
+def user_counters():
+    """Counters of disks borrowed and reserved by each member"""
+    added = add_column(User, 'borrowed_cnt', 'INTEGER NOT NULL DEFAULT 0')
+    added = add_column(
+        User, 'reserved_cnt', 'INTEGER NOT NULL DEFAULT 0') or added
+    if added:
+        reconcile.main()
+
+
+def votes():
+    """Votes of Movote moved from logs to their own table"""
+    if Vote.table_exists():
+        return
+    Vote.create_table()
+
+    # the film voted for is filled in related_refer by log_fields
+    cast = {}
+    log_sq = Log.select(
+        Log.model_refer, Log.related_refer, Log.user_affected,
+        Log.created_at
+    ).where(
+        Log.model == 'RegularFilmShow', Log.log_type == 'vote',
+        ~(Log.related_refer >> None), ~(Log.user_affected >> None)
+    ).order_by(Log.id.asc()).tuples()
+    for show_id, film_id, user_id, created_at in log_sq:
+        voted = cast.setdefault((show_id, user_id), [])
+        if film_id in voted or len(voted) >= 2:
+            continue
+        voted.append(film_id)
+        Vote.create(show=show_id, user=user_id, film=film_id,
+                    slot=len(voted), created_at=created_at)
+
+
+def attendances():
+    """Participants of shows moved from participant_list to a table"""
+    if Attendance.table_exists():
+        return
+    Attendance.create_table()
+
+    for show in RegularFilmShow.select():
+        recorded = set()
+        for user_id in show.participant_list:
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                continue
+            if user_id in recorded or not \
+                    User.select().where(User.id == user_id).exists():
+                continue
+            recorded.add(user_id)
+            # rfs_count of the member has been increased before
+            Attendance.create(show=show.id, user=user_id)
+
+
+def log_fields():
+    """Typed fields of logs parsed from their content"""
+    add_column(Log, 'sub_type', 'VARCHAR(16) NULL')
+    add_column(Log, 'value', 'INTEGER NULL')
+    add_column(Log, 'related_refer', 'INTEGER NULL')
+    add_index(Log,
+        'log_model_model_refer_log_type_user_affected_id_created_at',
+        ['model', 'model_refer', 'log_type', 'user_affected_id', 'created_at'])
+
+    # (log_type, content pattern, fields to set) of Disk logs
+    patterns = [
+        ('rate', 'member % rate +1 for disk %', dict(sub_type='up', value=1)),
+        ('rate', 'member % rate -1 for disk %',
+            dict(sub_type='down', value=-1)),
+        ('borrow', 'check out disk %', dict(sub_type='checkout')),
+        ('borrow', 'member % renews disk %', dict(sub_type='renew')),
+        ('borrow', 'take out disk %', dict(sub_type='deliver')),
+        ('borrow', 'check in disk %', dict(sub_type='checkin')),
+        ('reserve', 'member % reserves disk % (counter)%',
+            dict(sub_type='counter')),
+        ('reserve', 'member % reserves disk % (Hall %',
+            dict(sub_type='hall')),
+        ('reserve', 'clear reservation for disk %', dict(sub_type='clear')),
+    ]
+    for log_type, pattern, fields in patterns:
+        Log.update(**fields).where(
+            Log.model == 'Disk', Log.log_type == log_type,
+            Log.sub_type >> None, Log.content % pattern).execute()
+
+    # votes end with the number of the film voted for
+    for vote in [1, 2, 3]:
+        Log.update(value=vote).where(
+            Log.model == 'RegularFilmShow', Log.log_type == 'vote',
+            Log.value >> None,
+            Log.content % ('member %% vote for film No. %d' % vote)
+        ).execute()
+    Log._meta.database.execute_sql(
+        "UPDATE `log` JOIN `regularfilmshow` "
+        "ON `log`.`model_refer` = `regularfilmshow`.`id` "
+        "SET `log`.`related_refer` = CASE `log`.`value` "
+        "WHEN 1 THEN `regularfilmshow`.`film_1_id` "
+        "WHEN 2 THEN `regularfilmshow`.`film_2_id` "
+        "WHEN 3 THEN `regularfilmshow`.`film_3_id` END "
+        "WHERE `log`.`model` = 'RegularFilmShow' "
+        "AND `log`.`log_type` = 'vote' "
+        "AND `log`.`related_refer` IS NULL")
+
+
+def file_variants():
+    """Smaller copies of uploaded images"""
+    add_column(File, 'variants', 'LONGTEXT NULL')
+
+
+def disk_index():
+    """Tags and actors of disks in association tables"""
+    created = False
+    for model in [DiskTag, DiskActor, TagFacet]:
+        if not model.table_exists():
+            model.create_table()
+            created = True
+    if not created:
+        return
+
+    for disk in Disk.select():
+        tags, actors = disk.get_indexed_lists()
+        sync_names(DiskTag, DiskTag.tag, disk.id, tags)
+        sync_names(DiskActor, DiskActor.actor, disk.id, actors)
+
+    # count the facets at once
+    TagFacet.delete().execute()
+    sq = DiskTag.select(DiskTag.tag, fn.Count(DiskTag.id)).group_by(
+        DiskTag.tag).tuples()
+    for tag, cnt in sq:
+        TagFacet.create(tag=tag, count=cnt)
+
+
+def model_indexes():
+    """Indexes declared in models after the tables were created"""
+    for model, fields, unique in missing_indexes():
+        print "  adding %s" % index_name(model, fields)
+        add_index(model, index_name(model, fields),
+            [model._meta.fields[x].db_column for x in fields], unique)
+
+
+# the models of the website
+all_models = [
+    File, User, Log, Disk, RegularFilmShow, Vote, Attendance,
+    DiskTag, DiskActor, TagFacet, PreviewShowTicket, DiskReview, News,
+    Document, Publication, Sponsor, Exco, SiteSettings, OneSentence,
+]
+
+# the steps to apply, in order
+steps = [
+    user_counters,
+    # adds columns of Log, which any select of logs names
+    log_fields,
+    votes,
+    attendances,
+    model_indexes,
+    file_variants,
+    disk_index,
+]
+
+
+def main():
+    for step in steps:
+        print "%s: %s" % (step.__name__, step.__doc__)
+        step()
+
+if __name__ == '__main__':
+    main()
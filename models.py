@@ -3,16 +3,28 @@ from datetime import date, datetime, timedelta
 from flask import render_template, g
 from peewee import *
 
+from app import app
 from frame_ext import IterableModel, BusinessException
-from db_ext import SimpleListField
+from db_ext import SimpleListField, JSONField, IntegrityError, \
+    EncodedList
 from helpers import send_email
+from cache_ext import TimedCache, object_cache, model_changed, \
+                        on_model_change
 
 __all__ = [
     'File',
     'User',
     'Log',
+    'get_log_archive',
+    'log_archive_years',
+    'archive_years_between',
     'Disk',
     'RegularFilmShow',
+    'Vote',
+    'Attendance',
+    'DiskTag',
+    'DiskActor',
+    'TagFacet',
     'PreviewShowTicket',
     'DiskReview',
     'News',
@@ -35,11 +47,26 @@ class File(IterableModel):
         The display name of the file
     :param url:
         The storage path of the file
+    :param variants:
+        A dict of size name -> storage path of the smaller copies of an
+        image, made in the background after upload
     """
     id = PrimaryKeyField()
 
     name = CharField()
     url = CharField(unique=True)
+    variants = JSONField(null=True)
+
+    def get_url(self, size=None):
+        """Return the storage path of the file, or of a variant of it
+        if the variant exists
+
+        :param size:
+            The name of the variant
+        """
+        if size and self.variants and size in self.variants:
+            return self.variants[size]
+        return self.url
 
 
 class User(IterableModel):
@@ -85,6 +112,13 @@ class User(IterableModel):
     :param rfs_count:
         The times of the member participate in regular film show
 
+    :param borrowed_cnt:
+        The number of disks the member is holding now
+    :param reserved_cnt:
+        The number of disks the member is reserving now
+        Both counters are maintained by :class Disk: and can be rebuilt
+        by :file reconcile.py:
+
     :param admin:
         Whether the member is admin
     """
@@ -107,14 +141,53 @@ class User(IterableModel):
 
     rfs_count = IntegerField(default=0)
 
+    borrowed_cnt = IntegerField(default=0)
+    reserved_cnt = IntegerField(default=0)
+
     admin = BooleanField(default=False)
 
     class Meta:
         indexes = (
             (('full_name',), False),
+            (('member_type', 'expire_at'), False),
         )
         order_by = ('full_name', 'itsc',)
 
+    @classmethod
+    def acquire_slot(cls, user_id, counter, limit):
+        """Increase a counter of a user if it is below the limit
+
+        The check and the increment are done in a single UPDATE so that
+        concurrent requests cannot exceed the limit. Return whether the
+        counter is increased.
+
+        :param user_id:
+            The ID of the user
+        :param counter:
+            The name of the counter, borrowed_cnt or reserved_cnt
+        :param limit:
+            The maximum value of the counter
+        """
+        field = cls._meta.fields[counter]
+        updated = cls.update(**{counter: field + 1}).where(
+            cls.id == user_id, field < limit).execute()
+        model_changed(cls, user_id)
+        return updated > 0
+
+    @classmethod
+    def release_slot(cls, user_id, counter):
+        """Decrease a counter of a user
+
+        :param user_id:
+            The ID of the user
+        :param counter:
+            The name of the counter, borrowed_cnt or reserved_cnt
+        """
+        field = cls._meta.fields[counter]
+        cls.update(**{counter: field - 1}).where(
+            cls.id == user_id, field > 0).execute()
+        model_changed(cls, user_id)
+
 
 class Log(IterableModel):
     """Model to store logs of all the business
@@ -138,6 +211,18 @@ class Log(IterableModel):
     :param content:
         A concrete discription of the event
 
+    :param sub_type:
+        The detailed type of the event within log_type, so that
+        queries need not match the content. Currently:
+        borrow: checkout, renew, deliver, checkin
+        reserve: hall, counter, clear
+        rate: up, down
+    :param value:
+        The number carried by the event, +1/-1 of a rate, or the
+        number of the film voted for in votes before :class Vote:
+    :param related_refer:
+        The ID of another instance involved, the film voted for
+
     :param created_at:
         The date and time the log created
     """
@@ -151,6 +236,10 @@ class Log(IterableModel):
     admin_involved = ForeignKeyField(User, null=True)
     content = TextField(null=True)
 
+    sub_type = CharField(max_length=16, null=True)
+    value = IntegerField(null=True)
+    related_refer = IntegerField(null=True)
+
     created_at = DateTimeField(default=datetime.now)
 
     class Meta:
@@ -158,9 +247,88 @@ class Log(IterableModel):
             (('model',), False),
             (('model', 'log_type'), False),
             (('model', 'model_refer'), False),
+            (('model', 'model_refer', 'log_type',
+                'user_affected', 'created_at'), False),
+            (('created_at',), False),
         )
         order_by = ('-created_at', '-id')
 
+    @staticmethod
+    def archive_horizon():
+        """Return the time before which logs are moved to the archive
+        """
+        return datetime.now() - timedelta(
+            days=app.config.get('LOG_ARCHIVE_DAYS', 365))
+
+
+# year -> model of logs archived in that year
+_log_archives = {}
+
+
+def get_log_archive(year):
+    """Return the model of logs archived in a year
+
+    Logs older than the archive horizon are moved by
+    :file log_archive.py: to a table of each year with the same
+    columns as Log. The model is created on first use.
+
+    :param year:
+        The year the logs were created in
+    """
+    if year not in _log_archives:
+        class Meta:
+            db_table = 'log_archive_%d' % year
+            order_by = ('-created_at', '-id')
+
+        _log_archives[year] = type('LogArchive%d' % year, (IterableModel,), {
+            '__module__': __name__,
+            'Meta': Meta,
+            'id': PrimaryKeyField(),
+            'model': CharField(max_length=32),
+            'log_type': CharField(max_length=16),
+            'model_refer': IntegerField(),
+            'user_affected': ForeignKeyField(
+                User, related_name='archived_actions_%d' % year, null=True),
+            'admin_involved': ForeignKeyField(
+                User, related_name='archived_admin_%d' % year, null=True),
+            'content': TextField(null=True),
+            'sub_type': CharField(max_length=16, null=True),
+            'value': IntegerField(null=True),
+            'related_refer': IntegerField(null=True),
+            'created_at': DateTimeField(default=datetime.now),
+        })
+    return _log_archives[year]
+
+
+def log_archive_years():
+    """Return the years having an archive table, oldest first"""
+    cursor = Log._meta.database.execute_sql(
+        "SHOW TABLES LIKE 'log\\_archive\\_%%'")
+    rows = cursor.fetchall()
+    cursor.close()
+    years = []
+    for name, in rows:
+        try:
+            years.append(int(name[len('log_archive_'):]))
+        except ValueError:
+            continue
+    return sorted(years)
+
+
+def archive_years_between(years, lower=None, upper=None):
+    """Return the years of archives holding logs created in a range
+
+    :param years:
+        The years having an archive table
+    :param lower:
+        The earliest time of the range, or None if unbounded
+    :param upper:
+        The latest time of the range, or None if unbounded
+    """
+    return [x for x in years
+            if (lower is None or x >= lower.year) and
+                (upper is None or x <= upper.year)]
+
 
 class LogModel(IterableModel):
     """Model that has a foreign key to the log of creation
@@ -265,6 +433,11 @@ class Disk(LogModel):
     rank = DecimalField(default=0, auto_round=True)
 
     class Meta:
+        indexes = (
+            (('avail_type', 'due_at'), False),
+            (('borrow_cnt',), False),
+            (('rank',), False),
+        )
         order_by = ('-id',)
 
     @staticmethod
@@ -285,13 +458,19 @@ class Disk(LogModel):
 
     @staticmethod
     def get_borrow_limit():
-        """Return the limit of disk one user can borrow"""
-        return int(SiteSettings.get('liba_borrow'))
+        """Return the limit of disk one user can borrow, LIBA_BORROW_LIMIT
+        if the setting is missing or not a number
+        """
+        return SiteSettings.get_int(
+            'liba_borrow', app.config.get('LIBA_BORROW_LIMIT', 2))
 
     @staticmethod
     def get_reserve_limit():
-        """Return the limit of disk one user can borrow"""
-        return int(SiteSettings.get('liba_reserve'))
+        """Return the limit of disk one user can reserve,
+        LIBA_RESERVE_LIMIT if the setting is missing or not a number
+        """
+        return SiteSettings.get_int(
+            'liba_reserve', app.config.get('LIBA_RESERVE_LIMIT', 2))
 
     def get_callnumber(self):
         """Return the call number of the disk
@@ -310,16 +489,17 @@ class Disk(LogModel):
             The type of the reservation
         """
         # go through checks
-        reserve_limit = self.get_borrow_limit()
-        if user.reserved.count() >= reserve_limit:
-            raise BusinessException(
-                ("A member can reserve at most %d disks"
-                " at the same time" % reserve_limit), 
-                3)
         if self.avail_type != 'Available':
             raise BusinessException("Disk not reservable", 3)
         if not self.check_enable():
             raise BusinessException("VCD/DVD Library Closed", 3)
+        # take up a reservation slot of the user at last
+        reserve_limit = self.get_reserve_limit()
+        if not User.acquire_slot(user.id, 'reserved_cnt', reserve_limit):
+            raise BusinessException(
+                ("A member can reserve at most %d disks"
+                " at the same time" % reserve_limit), 
+                3)
 
         self.reserved_by = g.user
         self.avail_type = ("Reserved" if reserve_type == "Hall"
@@ -331,13 +511,14 @@ class Disk(LogModel):
                 'Reserved', 'ReservedCounter', 'OnDelivery']:
             raise BusinessException("The disk is not reserved", 3)
 
+        self.release_holders(reserve=True)
         self.reserved_by = None
         self.avail_type = 'Available'
 
     def deliver(self):
         """Deliver the disk"""
         borrow_limit = self.get_borrow_limit()
-        if self.reserved_by.borrowed.count() >= borrow_limit:
+        if self.reserved_by.borrowed_cnt >= borrow_limit:
             raise BusinessException(
                 ("A member can borrow at most %d disks"
                 " at the same time" % borrow_limit),
@@ -351,35 +532,37 @@ class Disk(LogModel):
         """Check out the disk
 
         Check the state of the disk and then set essential fields of
-        the disk. Note that this method will not save the instance.
+        the disk. Note that this method will not save the instance,
+        while the counters of the users are updated at once.
 
         :param user:
             The user that tries to borrow the disk
         """
-        borrow_limit = self.get_borrow_limit()
-        if user.borrowed.count() >= borrow_limit:
-            raise BusinessException(
-                ("A member can borrow at most %d disks"
-                " at the same time" % borrow_limit),
-                3)
         if not self.check_enable():
             raise BusinessException("VCD/DVD Library Closed", 3)
         if self.avail_type not in [
                 "Available", 'Reserved',
                 'ReservedCounter', 'OnDelivery']:
             raise BusinessException("The disk is not borrowable", 3)
+        # take up a borrowing slot of the user at last
+        borrow_limit = self.get_borrow_limit()
+        if not User.acquire_slot(user.id, 'borrowed_cnt', borrow_limit):
+            raise BusinessException(
+                ("A member can borrow at most %d disks"
+                " at the same time" % borrow_limit),
+                3)
         
+        self.release_holders(reserve=True)
         self.reserved_by = None
         self.avail_type = "Borrowed"
         self.hold_by = user
 
         # set due date
-        due_date = SiteSettings.get('due_date')
-        self.due_at = datetime.strptime(due_date, '%Y-%m-%d').date() \
-                        if due_date else date.today() + timedelta(7)
+        self.due_at = (SiteSettings.get_date('due_date') or
+                        date.today() + timedelta(7))
 
         # set borrow count
-        self.borrow_cnt += 1
+        self.increment('borrow_cnt')
 
     def renew(self):
         """Renew the disk"""
@@ -393,7 +576,7 @@ class Disk(LogModel):
                 Log.model == 'Disk', Log.model_refer == self.id,
                 Log.log_type == 'borrow', Log.user_affected == self.hold_by
             ).order_by(Log.created_at.desc()).get()
-        if 'renew' in last_log.content:
+        if last_log.sub_type == 'renew':
             # renewed before
             raise BusinessException(
                 "The disk can only be renewed once", 3)
@@ -404,35 +587,42 @@ class Disk(LogModel):
         """Check in the disk
 
         Check the state of the disk and then set essential fields of
-        the disk. Note that this method will not save the instance.
+        the disk. Note that this method will not save the instance,
+        while the counter of the holder is updated at once.
         """
         if self.avail_type != "Borrowed":
            raise BusinessException("The disk is not borrowed", 3)
 
+        self.release_holders(hold=True)
         self.avail_type = "Available"
         self.hold_by = None
         self.due_at = None
 
+    def release_holders(self, hold=False, reserve=False):
+        """Decrease the counters of the holder and the reserver of the
+        disk. Called before hold_by or reserved_by is cleared.
+
+        :param hold:
+            Whether to release the holder
+        :param reserve:
+            Whether to release the reserver
+        """
+        # read the raw ID to avoid loading the users
+        if hold and self._data.get('hold_by'):
+            User.release_slot(self._data['hold_by'], 'borrowed_cnt')
+        if reserve and self._data.get('reserved_by'):
+            User.release_slot(self._data['reserved_by'], 'reserved_cnt')
+
     def get_rate(self):
         """Return the ups and downs this disk receive
 
         A tuple (ups, downs) is returned
-
-        TODO: I believe there is better way to implement this
-        Maybe it is possible to query the two value in one SQL
         """
-        return (
-            Log.select().where(
-                Log.model == 'Disk',
-                Log.model_refer == self.id,
-                Log.log_type == 'rate',
-                Log.content ** "member % rate +1 for disk %").count(),
-            Log.select().where(
-                Log.model == 'Disk',
-                Log.model_refer == self.id,
-                Log.log_type == 'rate',
-                Log.content ** "member % rate -1 for disk %").count(),
-        )
+        rates = dict(Log.select(Log.value, fn.Count(Log.id)).where(
+            Log.model == 'Disk',
+            Log.model_refer == self.id,
+            Log.log_type == 'rate').group_by(Log.value).tuples())
+        return rates.get(1, 0), rates.get(-1, 0)
 
     def add_rate(self, user, rate='up'):
         """Add rate to the disk
@@ -449,7 +639,8 @@ class Disk(LogModel):
                 Log.log_type == 'rate', Log.user_affected == user).exists():
             raise BusinessException("You have rated this disk before", 3)
         new_log = Log(model='Disk', model_refer=self.id,
-                        log_type='rate', user_affected=g.user)
+                        log_type='rate', user_affected=g.user,
+                        sub_type=rate, value=(1 if rate == 'up' else -1))
         if rate == 'up':
             new_log.content = ("member %s rate +1 for disk %s" % 
                                 (g.user.itsc, self.get_callnumber()))
@@ -459,6 +650,60 @@ class Disk(LogModel):
 
         new_log.save()
 
+    @staticmethod
+    def unique_names(names):
+        """Return the names stripped, without blanks and duplicates
+        differing only in case, as the indexes compare them
+
+        :param names:
+            A list, or a text assigned to a SimpleListField, which is
+            split as the field splits it when loaded
+        """
+        if isinstance(names, basestring):
+            names = EncodedList(names).decode()
+        result = {}
+        for name in names or []:
+            name = name.strip()
+            if name:
+                result.setdefault(name.lower(), name)
+        return result.values()
+
+    def get_indexed_lists(self):
+        """Return the tags and actors kept in the association tables"""
+        return (sorted(self.unique_names(self.tags)),
+                sorted(self.unique_names(self.actors)))
+
+    def get_indexed_raw(self):
+        """Return the texts of the tags and actors as stored, which
+        does not decode them if they are not read
+        """
+        return (Disk.tags.db_value(self._data.get('tags')),
+                Disk.actors.db_value(self._data.get('actors')))
+
+    def prepared(self):
+        super(Disk, self).prepared()
+        self.__dict__['_indexed'] = self.get_indexed_raw()
+
+    def sync_index(self):
+        """Bring DiskTag, DiskActor and TagFacet in line with the tags
+        and actors of the disk
+        """
+        tags, actors = self.get_indexed_lists()
+        DiskTag.sync(self.id, tags)
+        DiskActor.sync(self.id, actors)
+
+    def save(self, *args, **kwargs):
+        changed = self.get_indexed_raw() != self.__dict__.get('_indexed')
+        result = super(Disk, self).save(*args, **kwargs)
+        if changed:
+            self.sync_index()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        DiskTag.sync(self.id, [])
+        DiskActor.sync(self.id, [])
+        return super(Disk, self).delete_instance(*args, **kwargs)
+
 
 class RegularFilmShow(LogModel):
     """Model to store Regular Film Show information
@@ -487,11 +732,14 @@ class RegularFilmShow(LogModel):
         The vote for film_2
     :param vote_cnt_3:
         The vote for film_3
+        No longer written, the votes are stored in :class Vote: and
+        counted by get_tally
 
     :param remarks:
         The remarks for this show
     :param participant_list:
         A list of participants who attend this show
+        No longer written, superseded by :class Attendance:
     """
         
     id = PrimaryKeyField()
@@ -510,43 +758,67 @@ class RegularFilmShow(LogModel):
     participant_list = SimpleListField(null=True)
 
     class Meta:
+        indexes = (
+            (('state',), False),
+        )
         order_by = ('-id',)
 
+    # keep the ID of the latest show until any show changes
+    _recent = TimedCache(app.config.get('OBJECT_CACHE_TTL', 60))
+
     @classmethod
     def get_recent(cls):
         """Return the latest regular film show"""
-        return cls.select().where(
-            cls.state != "Draft"
-        ).order_by(cls.id.desc()).limit(1).get()
-
-    def add_vote(self, user, vote):
+        recent_id = cls._recent.get('id')
+        if recent_id is None:
+            recent_id = cls.select(cls.id).where(
+                cls.state != "Draft"
+            ).order_by(cls.id.desc()).limit(1).get().id
+            cls._recent.set('id', recent_id)
+        return object_cache.fetch(cls.select(), recent_id)
+
+    def get_film_ids(self):
+        """Return the IDs of the candidate films"""
+        return [self._data['film_%d' % x] for x in [1, 2, 3]
+                if self._data.get('film_%d' % x)]
+
+    def add_vote(self, user, film_id):
         """Add a user vote to the show
 
         :param user:
             The user who casts the vote
-        :param vote:
-            The film id voted for
-            can be 1, 2, or 3
+        :param film_id:
+            The ID of the candidate film voted for
         """
         if self.state != 'Open':
             raise BusinessException("The show cannot be voted now", 3)
-        vote_log = [x.content[-1] for x in
-            Log.select().where(
-                Log.model == "RegularFilmShow",
-                Log.model_refer == self.id,
-                Log.log_type == "vote", Log.user_affected == user)]
-        if len(vote_log) >= 2:
+        if film_id not in self.get_film_ids():
+            raise BusinessException("Invalid Choice", 3)
+        voted = [x._data['film'] for x in Vote.select(Vote.film).where(
+            Vote.show == self.id, Vote.user == user.id)]
+        if len(voted) >= 2:
             raise BusinessException("A member can vote at most twice", 3)
-        if vote in vote_log:
+        if film_id in voted:
+            raise BusinessException("You have voted before", 3)
+        try:
+            # the unique indexes reject concurrent duplicate votes
+            Vote.create(show=self.id, user=user.id, film=film_id,
+                        slot=len(voted) + 1)
+        except IntegrityError:
             raise BusinessException("You have voted before", 3)
-        # add vote count
-        setattr(self,
-                "vote_cnt_%s" % vote, getattr(self, "vote_cnt_%s" % vote) + 1)
         # add log
         Log.create(
             model="RegularFilmShow", model_refer=self.id,
             log_type="vote", user_affected=g.user,
-            content="member %s vote for film No. %s" % (user.itsc, vote))
+            related_refer=film_id,
+            content="member %s vote for disk %s" % (user.itsc, film_id))
+
+    def get_tally(self):
+        """Return a dict of film ID -> the votes it gets"""
+        tally = dict((x, 0) for x in self.get_film_ids())
+        tally.update(Vote.select(Vote.film, fn.Count(Vote.id)).where(
+            Vote.show == self.id).group_by(Vote.film).tuples())
+        return tally
 
     def signin_user(self, user):
         """Sign in a participant
@@ -554,18 +826,254 @@ class RegularFilmShow(LogModel):
         :param user:
             The user to be signed in
         """
+        if not self.signin_users([user]):
+            raise BusinessException("Recorded before", 3)
+
+    def signin_users(self, users):
+        """Sign in a batch of participants
+
+        Return the list of users signed in. Those recorded before are
+        skipped.
+
+        :param users:
+            The users to be signed in
+        """
         if self.state != 'Pending':
             raise BusinessException("The show is not in Pending mode", 3)
-        if user.id in self.participant_list:
-            raise BusinessException("Recorded before", 3)
-        user.rfs_count += 1
-        self.participant_list.append(user.id)
+        if not users:
+            return []
+        recorded = set(x._data['user'] for x in
+            Attendance.select(Attendance.user).where(
+                Attendance.show == self.id,
+                Attendance.user << [x.id for x in users]))
+        signed = []
+        for user in users:
+            if user.id in recorded:
+                continue
+            try:
+                # the unique index rejects concurrent sign in
+                Attendance.create(show=self.id, user=user.id)
+            except IntegrityError:
+                continue
+            recorded.add(user.id)
+            signed.append(user)
+        if signed:
+            User.update(rfs_count=User.rfs_count + 1).where(
+                User.id << [x.id for x in signed]).execute()
+            model_changed(User)
+        return signed
+
+    def get_participants(self):
+        """Return the IDs of the participants"""
+        return [x._data['user'] for x in
+            Attendance.select(Attendance.user).where(
+                Attendance.show == self.id).order_by(Attendance.id)]
 
     def to_show(self):
-        """Return the disk that wins the Movote
+        """Return the disk that wins the Movote, the earlier candidate
+        on a tie
         """
-        idx = max([1, 2, 3],key=lambda o: getattr(self, "vote_cnt_%d" % o))
-        return getattr(self, "film_%d" % idx)
+        tally = self.get_tally()
+        film_id = max(self.get_film_ids(), key=lambda x: tally[x])
+        return Disk.get(Disk.id == film_id)
+
+
+class Vote(IterableModel):
+    """Model of votes cast in Movote
+
+    A member can vote for a film once and at most twice in a show. Both
+    rules are kept by unique indexes.
+
+    :param id:
+        A unique ID of a vote
+
+    :param show:
+        The show voted in
+    :param user:
+        The member who casts the vote
+    :param film:
+        The film voted for
+    :param slot:
+        1 or 2, the order of the vote among the votes of the member in
+        the show
+
+    :param created_at:
+        The date and time the vote cast
+    """
+    id = PrimaryKeyField()
+
+    show = ForeignKeyField(RegularFilmShow, related_name='votes')
+    user = ForeignKeyField(User, related_name='votes')
+    film = ForeignKeyField(Disk, related_name='votes')
+    slot = IntegerField()
+
+    created_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = (
+            (('show', 'user', 'film'), True),
+            (('show', 'user', 'slot'), True),
+            (('show', 'film'), False),
+        )
+
+
+class Attendance(IterableModel):
+    """Model of participants of regular film shows
+
+    :param id:
+        A unique ID of an attendance
+    :param show:
+        The show attended
+    :param user:
+        The member who attends the show
+    :param created_at:
+        The date and time the member signed in
+    """
+    id = PrimaryKeyField()
+
+    show = ForeignKeyField(RegularFilmShow, related_name='attendances')
+    user = ForeignKeyField(User, related_name='attendances')
+
+    created_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = (
+            (('show', 'user'), True),
+        )
+
+
+def sync_names(model, field, disk_id, names):
+    """Make the names of a disk in an association table equal to names
+
+    Return (names added, names removed).
+
+    :param model:
+        The association model
+    :param field:
+        The field holding the names
+    :param disk_id:
+        The ID of the disk
+    :param names:
+        The names the disk has now
+    """
+    old = dict((x.lower(), x) for x, in model.select(field).where(
+        model.disk == disk_id).tuples())
+    new = dict((x[:64].lower(), x[:64]) for x in names)
+    removed = [old[x] for x in old if x not in new]
+    added = [new[x] for x in new if x not in old]
+    if removed:
+        model.delete().where(
+            model.disk == disk_id, field << removed).execute()
+    for name in added:
+        model.create(**{'disk': disk_id, field.name: name})
+    return added, removed
+
+
+class DiskTag(IterableModel):
+    """Model of the tags of disks, kept in step with Disk.tags so that
+    disks can be looked up by tag through an index
+
+    :param id:
+        A unique ID of the association
+    :param disk:
+        The disk tagged
+    :param tag:
+        The tag
+    """
+    id = PrimaryKeyField()
+
+    disk = ForeignKeyField(Disk, related_name='tag_set')
+    tag = CharField(max_length=64)
+
+    class Meta:
+        indexes = (
+            (('disk', 'tag'), True),
+            (('tag',), False),
+        )
+
+    @classmethod
+    def sync(cls, disk_id, tags):
+        """Make the tags of a disk equal to tags, and count the change
+        in TagFacet
+
+        :param disk_id:
+            The ID of the disk
+        :param tags:
+            The tags the disk has now
+        """
+        added, removed = sync_names(cls, cls.tag, disk_id, tags)
+        for tag in added:
+            TagFacet.add(tag, 1)
+        for tag in removed:
+            TagFacet.add(tag, -1)
+
+
+class DiskActor(IterableModel):
+    """Model of the actors of disks, kept in step with Disk.actors
+
+    :param id:
+        A unique ID of the association
+    :param disk:
+        The disk the actor plays in
+    :param actor:
+        The name of the actor
+    """
+    id = PrimaryKeyField()
+
+    disk = ForeignKeyField(Disk, related_name='actor_set')
+    actor = CharField(max_length=64)
+
+    class Meta:
+        indexes = (
+            (('disk', 'actor'), True),
+            (('actor',), False),
+        )
+
+    @classmethod
+    def sync(cls, disk_id, actors):
+        """Make the actors of a disk equal to actors
+
+        :param disk_id:
+            The ID of the disk
+        :param actors:
+            The actors the disk has now
+        """
+        sync_names(cls, cls.actor, disk_id, actors)
+
+
+class TagFacet(IterableModel):
+    """Model of the number of disks of each tag, changed as disks are
+    tagged and untagged
+
+    :param tag:
+        The tag
+    :param count:
+        The number of disks with the tag
+    """
+    tag = CharField(max_length=64, primary_key=True)
+    count = IntegerField(default=0)
+
+    class Meta:
+        order_by = ('-count',)
+
+    @classmethod
+    def add(cls, tag, delta):
+        """Add delta to the count of a tag
+
+        :param tag:
+            The tag
+        :param delta:
+            The number to add
+        """
+        if cls.update(count=cls.count + delta).where(
+                cls.tag == tag).execute():
+            return
+        try:
+            cls.create(tag=tag, count=max(delta, 0))
+        except IntegrityError:
+            # created by another request at the same time
+            cls.update(count=cls.count + delta).where(
+                cls.tag == tag).execute()
 
 
 class PreviewShowTicket(LogModel):
@@ -645,6 +1153,9 @@ class PreviewShowTicket(LogModel):
     successful_applicant = TextField(null=True)
 
     class Meta:
+        indexes = (
+            (('state', 'apply_deadline'), False),
+        )
         order_by = ('-apply_deadline', '-id',)
 
     def add_application(self, user, data):
@@ -830,7 +1341,10 @@ class Exco(IterableModel):
 class SiteSettings(IterableModel):
     """Model of some common settings of website
 
-    The settings are stroed in key-value pair
+    The settings are stroed in key-value pair. All the settings are
+    loaded at once and kept in memory, reads are served from the
+    snapshot until it is invalidated or expires after
+    SETTINGS_CACHE_TTL seconds.
 
     :param key:
         The key of a setting
@@ -840,17 +1354,64 @@ class SiteSettings(IterableModel):
     key = CharField(max_length=16, unique=True)
     value = CharField()
 
+    _cache = TimedCache(app.config.get('SETTINGS_CACHE_TTL', 60))
+
+    @classmethod
+    def load(cls):
+        """Load all the settings into memory and return them as a dict
+        """
+        settings = dict((x.key, x.value) for x in cls.select())
+        cls._cache.set('settings', settings)
+        return settings
+
     @classmethod
-    def get(cls, key):
+    def invalidate(cls):
+        """Drop the in-memory snapshot of the settings"""
+        cls._cache.clear()
+
+    @classmethod
+    def get(cls, key, default=None):
         """Return the value of a setting
 
         :param key:
             The key of the setting
+        :param default:
+            The value returned if the setting does not exist
+        """
+        settings = cls._cache.get('settings')
+        if settings is None:
+            settings = cls.load()
+        return settings.get(key, default)
+
+    @classmethod
+    def get_int(cls, key, default=None):
+        """Return the value of a setting as an integer
+
+        :param key:
+            The key of the setting
+        :param default:
+            The value returned if the setting does not exist or is not
+            an integer
         """
         try:
-            return cls.select().where(cls.key == key).get().value
-        except DoesNotExist:
-            return None
+            return int(cls.get(key))
+        except (TypeError, ValueError):
+            return default
+
+    @classmethod
+    def get_date(cls, key, default=None):
+        """Return the value of a setting in format YYYY-MM-DD as a date
+
+        :param key:
+            The key of the setting
+        :param default:
+            The value returned if the setting does not exist or is not
+            a date
+        """
+        try:
+            return datetime.strptime(cls.get(key), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return default
 
 
 class OneSentence(LogModel):
@@ -868,6 +1429,13 @@ class OneSentence(LogModel):
     content = TextField()
 
 
+@on_model_change
+def forget_recent_show(model, pk):
+    """Drop the cached latest show when a show changes"""
+    if model is RegularFilmShow:
+        RegularFilmShow._recent.clear()
+
+
 def create_tables():
     # used when setting up database for the first time
     File.create_table()
@@ -875,6 +1443,11 @@ def create_tables():
     Log.create_table()
     Disk.create_table()
     RegularFilmShow.create_table()
+    Vote.create_table()
+    Attendance.create_table()
+    DiskTag.create_table()
+    DiskActor.create_table()
+    TagFacet.create_table()
     PreviewShowTicket.create_table()
     DiskReview.create_table()
     News.create_table()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+# A little script to rebuild the counters of disks borrowed and
+# reserved by each member from the disks themselves.
+# The script may be set up as a scheduled task to fix any drift.
+
+from models import *
+from cache_ext import model_changed
+
+
+def count_sql(field):
+    """Return the SQL counting the disks referring to the member in the
+    UPDATE through field
+    """
+    return "(SELECT COUNT(*) FROM `%s` WHERE `%s`.`%s` = `%s`.`%s`)" % (
+        Disk._meta.db_table, Disk._meta.db_table, field.db_column,
+        User._meta.db_table, User.id.db_column)
+
+
+def main():
+    """Compare the counters of each member with the disks and fix them
+    in a single UPDATE. Return the number of members fixed.
+    """
+    borrowed = count_sql(Disk.hold_by)
+    reserved = count_sql(Disk.reserved_by)
+    cursor = User._meta.database.execute_sql(
+        "UPDATE `%s` SET `%s` = %s, `%s` = %s "
+        "WHERE `%s` <> %s OR `%s` <> %s" % (
+            User._meta.db_table,
+            User.borrowed_cnt.db_column, borrowed,
+            User.reserved_cnt.db_column, reserved,
+            User.borrowed_cnt.db_column, borrowed,
+            User.reserved_cnt.db_column, reserved))
+    fixed = cursor.rowcount
+    cursor.close()
+    if fixed:
+        model_changed(User)
+    return fixed
+
+if __name__ == '__main__':
+    main()
@@ -34,7 +34,7 @@ def main():
                 Log.log_type == 'borrow',
                 Log.user_affected == disk.hold_by
             ).order_by(Log.created_at.desc()).get()
-        if 'renew' not in last_log.content:
+        if last_log.sub_type != 'renew':
             body = tp_reminder.render(disk=disk)
             send_email(
                 [disk.hold_by.itsc + '@ust.hk'],
@@ -77,13 +77,13 @@ def main():
                 Log.user_affected == disk.reserved_by
             ).order_by(Log.created_at.desc()).get()
         if date.today() - reserve_log.created_at.date() > timedelta(2):
-            disk.reserved_by = None
-            disk.avail_type = 'Available'
+            disk.clear_reservation()
             disk.save()
             Log.create(
                 model="Disk",
                 model_refer=disk.id,
                 log_type="reserve",
+                sub_type="clear",
                 content="clear reservation for disk %s(automatically)" % 
                 disk.get_callnumber())
 
@@ -8,10 +8,10 @@
 
 from datetime import datetime
 import StringIO
-from ftplib import FTP
 
 from app import app
 from models import *
+from storage import storage, UPLOAD_DIR
 
 def write_tag(output, url, img=None, lastmod=None, changefreq="yearly", priority=0.5):
     print >>output, '<url>'
@@ -22,7 +22,7 @@ def write_tag(output, url, img=None, lastmod=None, changefreq="yearly", priority
     print >>output, '<priority>%s</priority>' % priority
     if img:
         print >>output, '<image:image>'
-        print >>output, '<image:loc>http://ihome.ust.hk/~su_film/asset/upload/%s</image:loc>' % img
+        print >>output, '<image:loc>%s</image:loc>' % storage.url(UPLOAD_DIR + img)
         print >>output, '</image:image>'
     print >>output, '</url>'
 
@@ -78,10 +78,8 @@ def main():
     print >>output, "</urlset>"
 
     output.seek(0)
-    conn = FTP('ihome.ust.hk', app.config['SOCIETY_USERNAME'], app.config['SOCIETY_PASSWORD'])
-    conn.cwd('/')
-    conn.storbinary("STOR sitemap.xml", output)
-    conn.quit()
+    storage.store("sitemap.xml", output)
+    storage.close()
     output.close()
 
 if __name__ == '__main__':
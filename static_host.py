@@ -1,8 +1,6 @@
 # This file declares several static pages identical to frontend
 # for googlebot to crawl the pages
 
-import math
-import socket
 from markupsafe import Markup, escape
 
 from flask import Blueprint, g, render_template, request, Response, abort
@@ -11,6 +9,9 @@ from peewee import *
 from app import app
 from models import *
 from bbcode import BBCode
+from catalogue import catalogue
+from allowlist import Allowlist
+from storage import storage, UPLOAD_DIR
 
 __all__ = ['static_host']
 
@@ -19,10 +20,10 @@ static_host = Blueprint('static_host',
 
 
 @static_host.app_template_filter('file_location')
-def file_location(file_):
-    return ("http://ihome.ust.hk/~su_film/asset/" +
-            ("upload/%s" % file_.url if file_ is not None
-                else "css/question.png"))
+def file_location(file_, size=None):
+    if file_ is None:
+        return "http://ihome.ust.hk/~su_film/asset/css/question.png"
+    return storage.url(UPLOAD_DIR + file_.get_url(size))
 
 @static_host.app_template_filter('todate')
 def todatestring(data, format=""):
@@ -38,10 +39,17 @@ def towrap(data):
             Markup('</p>'))
 
 
+# the front server and any other hosts or ranges allowed to crawl
+allowed_sources = Allowlist(
+    [app.config["FRONT_SERVER_HOST"]] +
+    app.config.get("STATIC_ALLOWLIST", []),
+    app.config.get("STATIC_ALLOWLIST_REFRESH", 300),
+    app.config.get("STATIC_ALLOWLIST_RETRY", 30))
+
+
 @static_host.before_request
 def limit_source():
-    if request.remote_addr != socket.gethostbyname(
-            app.config["FRONT_SERVER_HOST"]):
+    if not allowed_sources.allows(request.remote_addr):
         abort(403)
 
 
@@ -55,7 +63,7 @@ def static_404():
 @static_host.route('/')
 @static_host.route('/home/')
 def static_home():
-    cover_id = int(SiteSettings.get('header_image'))
+    cover_id = SiteSettings.get_int('header_image')
     cover_url = file_location(
         File.select().where(File.id == cover_id).get())
     news_sq = News.select().limit(15)
@@ -79,22 +87,18 @@ def static_show():
 
 @static_host.route('/library/')
 def static_library():
-    page = int(request.args.get("page", "1"))
+    page = max(int(request.args.get("page", "1")), 1)
     mode = request.args.get("mode", "")
 
-    disk_sq = Disk.select()
     if mode == "popular":
-        disk_sq = disk_sq.order_by(Disk.borrow_cnt.desc())
         title = "Top Popular"
     elif mode == "rank":
-        disk_sq = disk_sq.order_by(Disk.rank.desc())
         title = "Top Ranked"
     else:
-        disk_sq = disk_sq.order_by(Disk.id.desc())
+        mode = "newest"
         title = "VCD/DVD Library"
 
-    disk_sq = disk_sq.paginate(page, 6)
-    total_page = int(math.ceil(float(disk_sq.count()) / 6))
+    disk_sq, total_page = catalogue.get_page(mode, page, 6)
 
     prev_component = ["page=%d" % (page - 1)] if page > 1 else []
     if mode in ["popular", "rank"]:
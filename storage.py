@@ -0,0 +1,255 @@
+import os
+import time
+import errno
+import ftplib
+import posixpath
+import tempfile
+from abc import ABCMeta, abstractmethod
+from Queue import Queue, Empty, Full
+
+from flask import send_file, abort
+
+from app import app
+
+__all__ = [
+    'Storage',
+    'FTPStorage',
+    'LocalStorage',
+    'storage',
+    'UPLOAD_DIR',
+]
+
+# the directory of uploaded files in the storage
+UPLOAD_DIR = 'asset/upload/'
+
+
+class Storage(object):
+    """Where the files of the website are kept, e.g. uploads and the
+    sitemap. Paths are relative to the root of the storage. Subclasses
+    implement store().
+
+    :param base_url:
+        The URL the root of the storage is served at
+    :param blocksize:
+        The number of bytes sent at a time
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, base_url, blocksize=65536):
+        self.base_url = base_url
+        self.blocksize = blocksize
+
+    @abstractmethod
+    def store(self, path, file_handler, progress=None):
+        """Store the content of a file
+
+        :param path:
+            The path to store at
+        :param file_handler:
+            The file to read the content from
+        :param progress:
+            A function called with the number of bytes stored so far
+            after each block
+        """
+
+    def url(self, path):
+        """Return the URL a stored file is served at
+
+        :param path:
+            The path of the file
+        """
+        return self.base_url + path
+
+    def close(self):
+        """Release the connections held"""
+        pass
+
+
+class FTPStorage(Storage):
+    """Files kept on an FTP server
+
+    Connections are kept open in a pool and reused. A connection idle
+    for longer than keepalive seconds is checked with NOOP first, and
+    a transfer failed on a reused connection is retried once on a new
+    one.
+
+    :param host:
+        The FTP server
+    :param username:
+        The user to log in as
+    :param password:
+        The password of the user
+    :param base_url:
+        The URL the root of the storage is served at
+    :param size:
+        The maximum number of idle connections kept
+    :param keepalive:
+        The seconds a connection is trusted without checking
+    :param timeout:
+        The seconds to wait for the server
+    """
+    def __init__(self, host, username, password, base_url,
+                 size=2, keepalive=30, timeout=30, **kwargs):
+        super(FTPStorage, self).__init__(base_url, **kwargs)
+        self.host = host
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.timeout = timeout
+        # (connection, the time it is last used)
+        self._idle = Queue(size)
+
+    def _connect(self):
+        return ftplib.FTP(self.host, self.username, self.password,
+                          timeout=self.timeout)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except ftplib.all_errors:
+            pass
+
+    def _acquire(self):
+        """Return (a connection, whether it is reused)"""
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except Empty:
+                return self._connect(), False
+            if time.time() - last_used < self.keepalive:
+                return conn, True
+            try:
+                conn.voidcmd('NOOP')
+                return conn, True
+            except ftplib.all_errors:
+                self._discard(conn)
+
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait((conn, time.time()))
+        except Full:
+            self._discard(conn)
+
+    def _store(self, conn, path, file_handler, progress):
+        sent = [0]
+
+        def callback(block):
+            sent[0] += len(block)
+            progress(sent[0])
+
+        conn.storbinary('STOR ' + posixpath.join('/', path), file_handler,
+                        self.blocksize, callback if progress else None)
+
+    def store(self, path, file_handler, progress=None):
+        try:
+            start = file_handler.tell()
+        except (AttributeError, IOError):
+            start = None
+        conn, reused = self._acquire()
+        try:
+            self._store(conn, path, file_handler, progress)
+        except ftplib.all_errors:
+            self._discard(conn)
+            if not reused or start is None:
+                raise
+            # the server may have dropped the connection, start over
+            file_handler.seek(start)
+            conn = self._connect()
+            try:
+                self._store(conn, path, file_handler, progress)
+            except ftplib.all_errors:
+                self._discard(conn)
+                raise
+        self._release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except Empty:
+                return
+            try:
+                conn.quit()
+            except ftplib.all_errors:
+                self._discard(conn)
+
+
+class LocalStorage(Storage):
+    """Files kept in a local directory, served by the website itself
+    through send_file, which uses X-Sendfile if USE_X_SENDFILE is set
+    and the sendfile of the WSGI server otherwise
+
+    :param root:
+        The directory to keep the files in
+    :param base_url:
+        The URL the root of the storage is served at
+    """
+    def __init__(self, root, base_url, **kwargs):
+        super(LocalStorage, self).__init__(base_url, **kwargs)
+        self.root = os.path.abspath(root)
+
+    def local_path(self, path):
+        """Return the local path of a file, or None if the path points
+        out of the root
+        """
+        full = os.path.abspath(os.path.join(self.root, path))
+        if not full.startswith(self.root + os.sep):
+            return None
+        return full
+
+    def store(self, path, file_handler, progress=None):
+        full = self.local_path(path)
+        if full is None:
+            raise IOError(errno.EACCES, "Path out of the storage", path)
+        directory = os.path.dirname(full)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # write to a temporary file first, readers never see a part
+        fd, temp = tempfile.mkstemp(dir=directory)
+        sent = 0
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                for block in iter(
+                        lambda: file_handler.read(self.blocksize), ''):
+                    output.write(block)
+                    sent += len(block)
+                    if progress:
+                        progress(sent)
+            os.chmod(temp, 0644)
+            os.rename(temp, full)
+        except Exception:
+            os.unlink(temp)
+            raise
+
+    def serve(self, path):
+        """Return the response of a stored file
+
+        :param path:
+            The path of the file
+        """
+        full = self.local_path(path)
+        if full is None or not os.path.isfile(full):
+            abort(404)
+        return send_file(full, conditional=True)
+
+
+def get_storage():
+    """Return the storage configured by STORAGE_BACKEND"""
+    if app.config.get('STORAGE_BACKEND', 'ftp') == 'local':
+        return LocalStorage(
+            app.config.get('STORAGE_ROOT', 'storage'),
+            app.config.get('STORAGE_URL', '/storage/'))
+    return FTPStorage(
+        app.config.get('STORAGE_HOST', 'ihome.ust.hk'),
+        app.config['SOCIETY_USERNAME'], app.config['SOCIETY_PASSWORD'],
+        app.config.get('STORAGE_URL', 'http://ihome.ust.hk/~su_film/'))
+
+
+storage = get_storage()
+
+
+if isinstance(storage, LocalStorage):
+    @app.route('/storage/<path:path>')
+    def serve_storage(path):
+        return storage.serve(path)
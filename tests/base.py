@@ -0,0 +1,68 @@
+import unittest
+from datetime import date, timedelta
+
+import filmsoc
+from app import app
+from flask import json
+from cache_ext import object_cache
+from migrate import all_models
+from models import SiteSettings, User, Disk, Log
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """A test on empty tables of all the models, in the database of the
+    test settings
+    """
+    def setUp(self):
+        self.addCleanup(self.drop_tables)
+        for model in all_models:
+            model.create_table()
+        object_cache.local.clear()
+        SiteSettings.invalidate()
+
+    def drop_tables(self):
+        """Drop the tables, also when setUp fails half way"""
+        for model in reversed(all_models):
+            model.drop_table(fail_silently=True)
+        object_cache.local.clear()
+        SiteSettings.invalidate()
+
+    def make_user(self, itsc, **kwargs):
+        """Create a member"""
+        fields = dict(itsc=itsc, student_id=str(abs(hash(itsc)))[:8],
+                      full_name=itsc, member_type='Full',
+                      expire_at=date.today() + timedelta(365))
+        fields.update(kwargs)
+        return User.create(**fields)
+
+    def make_disk(self, **kwargs):
+        """Create an available disk"""
+        fields = dict(disk_type='A', title_en='Film', title_ch='Film',
+                      show_year=2000, avail_type='Available')
+        fields.update(kwargs)
+        if 'create_log' not in fields:
+            fields['create_log'] = Log.create(
+                model='Disk', log_type='create', model_refer=0)
+        return Disk.create(**fields)
+
+
+class ClientTestCase(DatabaseTestCase):
+    """A test making requests to the website"""
+    def setUp(self):
+        super(ClientTestCase, self).setUp()
+        self.client = app.test_client()
+
+    def login(self, user):
+        """Make the following requests as user"""
+        with self.client.session_transaction() as sess:
+            sess['logged_in'] = True
+            sess['user_pk'] = user.id
+
+    def api(self, method, url, data=None, headers=None):
+        """Make a request to the API as the front server does"""
+        headers = dict(headers or {})
+        headers['Referer'] = app.config['FRONT_SERVER'] + '/'
+        return self.client.open(
+            url, method=method,
+            data=json.dumps(data) if data is not None else None,
+            headers=headers)
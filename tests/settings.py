@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+
+class Settings(object):
+    """Settings of the tests, the modules under test read them through
+    app.config as the settings of the website
+    """
+    DEBUG = True
+    TESTING = True
+    SECRET_KEY = 'test'
+
+    # a file, as every request connects to the database again
+    DATABASE = {
+        'name': os.path.join(tempfile.gettempdir(), 'filmsoc-test.db'),
+        'engine': 'peewee.SqliteDatabase',
+        'check_same_thread': False,
+    }
+
+    FRONT_SERVER = 'http://front.test'
+    FRONT_SERVER_HOST = '127.0.0.1'
+    AUTH_SERVER = 'http://cas.test'
+    LDAP_SERVER = 'ldap://ldap.test'
+    SYMPA_SERVER = 'http://sympa.test'
+    MAILING_LIST = 'test'
+    SOCIETY_USERNAME = 'test'
+    SOCIETY_PASSWORD = 'test'
+
+    STORAGE_BACKEND = 'local'
+    THUMBNAIL_WORKERS = 0
@@ -0,0 +1,64 @@
+import socket
+import threading
+import time
+import unittest
+
+from allowlist import Allowlist, parse_address
+
+
+class AllowlistTest(unittest.TestCase):
+    def make_allowlist(self, answers):
+        """Return an allowlist of front.test and 10.0.0.0/8 which
+        resolves front.test to the answers in turn, an exception raised
+        """
+        allowlist = Allowlist(['front.test', '10.0.0.0/8'], 300, 30)
+        # refreshed by the test instead of in the background
+        allowlist._thread = threading.current_thread()
+
+        def resolve(host):
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return set(parse_address(x)[:2] for x in answer)
+        allowlist.resolve = resolve
+        return allowlist
+
+    def test_ranges_and_hosts(self):
+        allowlist = self.make_allowlist([['192.0.2.1', '2001:db8::1']])
+        self.assertTrue(allowlist.refresh())
+        self.assertTrue(allowlist.allows('10.1.2.3'))
+        self.assertTrue(allowlist.allows('192.0.2.1'))
+        self.assertTrue(allowlist.allows('2001:db8::1'))
+        self.assertFalse(allowlist.allows('192.0.2.2'))
+        self.assertFalse(allowlist.allows('not an address'))
+
+    def test_failure_keeps_last_good(self):
+        allowlist = self.make_allowlist(
+            [['192.0.2.1'], socket.gaierror('timed out'), []])
+        self.assertTrue(allowlist.refresh())
+        self.assertFalse(allowlist.refresh())
+        self.assertTrue(allowlist.allows('192.0.2.1'))
+        self.assertFalse(allowlist.refresh())
+        self.assertTrue(allowlist.allows('192.0.2.1'))
+
+    def test_failure_on_first_use_retried(self):
+        allowlist = self.make_allowlist(
+            [socket.gaierror('timed out'), ['192.0.2.1']])
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            if len(waits) > 1:
+                raise StopIteration
+        time_sleep, time.sleep = time.sleep, sleep
+        try:
+            self.assertRaises(StopIteration, allowlist._run,
+                              allowlist.refresh())
+        finally:
+            time.sleep = time_sleep
+        self.assertEqual(waits, [30, 300])
+        self.assertTrue(allowlist.allows('192.0.2.1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+from werkzeug.contrib.cache import SimpleCache
+
+from base import DatabaseTestCase
+from cache_ext import object_cache
+from catalogue import catalogue
+from models import Disk, Log
+
+
+class CatalogueTest(DatabaseTestCase):
+    def setUp(self):
+        super(CatalogueTest, self).setUp()
+        backend, object_cache.backend = object_cache.backend, SimpleCache()
+        self.addCleanup(setattr, object_cache, 'backend', backend)
+        catalogue.invalidate()
+
+        self.rebuilds = 0
+        rebuild = catalogue.rebuild
+
+        def count_rebuild():
+            self.rebuilds += 1
+            rebuild()
+        catalogue.rebuild = count_rebuild
+        self.addCleanup(delattr, catalogue, 'rebuild')
+
+    def insert_elsewhere(self):
+        """Add a disk as another process does, only the shared backend
+        hears about it
+        """
+        log = Log.create(model='Disk', log_type='create', model_refer=0)
+        Disk.insert(disk_type='A', title_en='Film', title_ch='Film',
+                    show_year=2000, avail_type='Available',
+                    create_log=log).execute()
+        object_cache.count_change(Disk)
+
+    def test_change_of_other_process_rebuilds(self):
+        self.make_disk()
+        self.assertEqual(catalogue.count(), 1)
+        self.insert_elsewhere()
+        self.assertEqual(catalogue.count(), 2)
+        self.assertEqual(self.rebuilds, 2)
+
+    def test_change_in_process_is_patched(self):
+        self.assertEqual(catalogue.count(), 0)
+        self.make_disk()
+        self.make_disk()
+        self.assertEqual(catalogue.count(), 2)
+        self.assertEqual(self.rebuilds, 1)
+
+    def test_patch_after_change_elsewhere_rebuilds(self):
+        self.assertEqual(catalogue.count(), 0)
+        self.insert_elsewhere()
+        self.make_disk()
+        self.assertEqual(catalogue.count(), 2)
+        self.assertEqual(self.rebuilds, 2)
@@ -0,0 +1,53 @@
+import reconcile
+from base import DatabaseTestCase, ClientTestCase
+from models import User, Disk, Log, SiteSettings
+
+
+class CounterTest(DatabaseTestCase):
+    def setUp(self):
+        super(CounterTest, self).setUp()
+        SiteSettings.create(key='liba_state', value='Open')
+        self.user = self.make_user('alice')
+        self.disk = self.make_disk()
+
+    def reload(self, user):
+        return User.get(User.id == user.id)
+
+    def test_check_out_and_in(self):
+        self.disk.check_out(self.user)
+        self.disk.save()
+        self.assertEqual(self.reload(self.user).borrowed_cnt, 1)
+        self.disk.check_in()
+        self.disk.save()
+        self.assertEqual(self.reload(self.user).borrowed_cnt, 0)
+
+    def test_reconcile_fixes_drift(self):
+        self.disk.hold_by = self.user
+        self.disk.save()
+        other = self.make_user('bob', reserved_cnt=3)
+        self.assertEqual(reconcile.main(), 2)
+        self.assertEqual(self.reload(self.user).borrowed_cnt, 1)
+        self.assertEqual(self.reload(other).reserved_cnt, 0)
+        self.assertEqual(reconcile.main(), 0)
+
+
+class SlotRollbackTest(ClientTestCase):
+    def test_failed_log_releases_slot(self):
+        SiteSettings.create(key='liba_state', value='Open')
+        admin = self.make_user('admin', admin=True)
+        member = self.make_user('alice')
+        disk = self.make_disk()
+        self.login(admin)
+
+        def fail(*args, **kwargs):
+            raise IOError("log table gone")
+        save, Log.save = Log.save, fail
+        try:
+            self.assertRaises(IOError, self.api, 'POST',
+                '/api/disk/%d/borrow/' % disk.id, {'id': member.id})
+        finally:
+            Log.save = save
+        self.assertEqual(
+            User.get(User.id == member.id).borrowed_cnt, 0)
+        self.assertEqual(
+            Disk.get(Disk.id == disk.id).avail_type, 'Available')
@@ -0,0 +1,49 @@
+import urlparse
+
+from base import ClientTestCase
+from flask import json
+
+
+class CursorTest(ClientTestCase):
+    def setUp(self):
+        super(CursorTest, self).setUp()
+        self.years = {}
+        for year in [2001, 2000, 2001, 1999, 2000]:
+            self.years[self.make_disk(show_year=year).id] = year
+
+    def get_page(self, query):
+        return json.loads(self.api('GET', '/api/disk/?' + query).data)
+
+    def walk(self, query):
+        """Return the IDs of disks on all the pages in turn"""
+        ids = []
+        page = self.get_page(query + '&cursor=')
+        while True:
+            ids.extend(x['id'] for x in page['objects'])
+            if not page['meta']['next']:
+                return ids
+            args = urlparse.parse_qs(
+                urlparse.urlparse(page['meta']['next']).query)
+            page = self.get_page(
+                query + '&cursor=' + args['cursor'][0])
+
+    def test_pages_with_ties(self):
+        ids = self.walk('limit=2&ordering=show_year')
+        # ties are broken by the primary key, descending
+        self.assertEqual(ids, sorted(
+            self.years, key=lambda x: (self.years[x], -x)))
+
+    def test_pages_by_primary_key(self):
+        self.assertEqual(self.walk('limit=2'),
+                         sorted(self.years, reverse=True))
+
+    def test_total_on_request(self):
+        page = self.get_page('limit=2&cursor=')
+        self.assertEqual(page['meta']['total'], None)
+        page = self.get_page('limit=2&cursor=&count=exact')
+        self.assertEqual(page['meta']['total'], 5)
+
+    def test_invalid_cursor(self):
+        for cursor in ['junk', 'e30=']:
+            page = self.get_page('cursor=' + cursor)
+            self.assertEqual(page['error'], "Invalid cursor")
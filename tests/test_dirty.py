@@ -0,0 +1,60 @@
+from base import DatabaseTestCase
+from models import User
+
+
+class DirtySaveTest(DatabaseTestCase):
+    def setUp(self):
+        super(DirtySaveTest, self).setUp()
+        self.user = self.make_user('alice', login_count=1)
+
+    def load(self):
+        return User.get(User.id == self.user.id)
+
+    def test_repeated_increments(self):
+        user = self.load()
+        user.increment('login_count')
+        user.increment('login_count')
+        self.assertEqual(user.login_count, 3)
+        user.save()
+        self.assertEqual(self.load().login_count, 3)
+
+    def test_increments_of_copies_add_up(self):
+        first, second = self.load(), self.load()
+        first.increment('login_count')
+        second.increment('login_count', 2)
+        first.save()
+        second.save()
+        self.assertEqual(self.load().login_count, 4)
+
+    def test_increment_after_assignment(self):
+        user = self.load()
+        user.login_count = 10
+        user.increment('login_count')
+        user.save()
+        self.assertEqual(self.load().login_count, 11)
+
+    def test_assignment_after_increment(self):
+        user = self.load()
+        user.increment('login_count')
+        user.login_count = 10
+        user.save()
+        self.assertEqual(self.load().login_count, 10)
+
+    def test_only_assigned_fields_written(self):
+        user = self.load()
+        User.update(full_name='Alice').where(
+            User.id == self.user.id).execute()
+        user.increment('login_count')
+        user.student_id = '12345678'
+        user.save()
+        saved = self.load()
+        self.assertEqual(saved.full_name, 'Alice')
+        self.assertEqual(saved.student_id, '12345678')
+        self.assertEqual(saved.login_count, 2)
+
+    def test_nothing_written_after_save(self):
+        user = self.load()
+        user.increment('login_count')
+        user.save()
+        user.save()
+        self.assertEqual(self.load().login_count, 2)
@@ -0,0 +1,29 @@
+import unittest
+
+from db_ext import Encoded, LazyTextField, SimpleListField, JSONField
+
+
+class LazyFieldTest(unittest.TestCase):
+    def test_plain_text(self):
+        field = LazyTextField()
+        value = field.python_value(u'text')
+        self.assertTrue(field.is_clean(value))
+        self.assertEqual(value.decode(), u'text')
+        self.assertEqual(field.db_value(value), u'text')
+        self.assertEqual(field.db_value(u'changed'), u'changed')
+        self.assertEqual(field.python_value(None), None)
+
+    def test_list(self):
+        field = SimpleListField()
+        value = field.python_value('a,b')
+        self.assertEqual(field.db_value(value), 'a,b')
+        self.assertEqual(value.decode(), ['a', 'b'])
+        self.assertEqual(field.db_value(['a', 1]), 'a,1')
+
+    def test_json(self):
+        field = JSONField()
+        value = field.python_value('{"a": 1}')
+        self.assertTrue(isinstance(value, Encoded))
+        self.assertEqual(value.decode(), {'a': 1})
+        self.assertEqual(field.db_value({'a': 1}), '{"a": 1}')
+        self.assertEqual(field.python_value(''), None)
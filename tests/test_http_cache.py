@@ -0,0 +1,45 @@
+from base import ClientTestCase
+from models import Log, News
+
+
+class ConditionalTest(ClientTestCase):
+    def add_news(self, title):
+        log = Log.create(model='News', log_type='create', model_refer=0)
+        return News.create(title=title, content=title, create_log=log)
+
+    def test_etag_answers_304(self):
+        self.add_news('first')
+        response = self.api('GET', '/api/news/')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'],
+                         'public, no-cache')
+        self.assertTrue(response.headers.get('Last-Modified'))
+
+        response = self.api('GET', '/api/news/', headers={
+            'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+
+    def test_change_makes_new_etag(self):
+        self.add_news('first')
+        etag = self.api('GET', '/api/news/').headers['ETag']
+        self.add_news('second')
+        response = self.api('GET', '/api/news/', headers={
+            'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('second', response.data)
+
+    def test_etag_differs_by_query(self):
+        self.add_news('first')
+        self.assertNotEqual(
+            self.api('GET', '/api/news/').headers['ETag'],
+            self.api('GET', '/api/news/?limit=1').headers['ETag'])
+
+    def test_if_modified_since(self):
+        self.add_news('first')
+        modified = self.api('GET', '/api/news/').headers['Last-Modified']
+        response = self.api('GET', '/api/news/', headers={
+            'If-Modified-Since': modified})
+        self.assertEqual(response.status_code, 304)
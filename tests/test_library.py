@@ -0,0 +1,28 @@
+from base import DatabaseTestCase
+from models import User, Disk, SiteSettings
+
+
+class LimitTest(DatabaseTestCase):
+    def test_limits_default_without_settings(self):
+        self.assertEqual(Disk.get_borrow_limit(), 2)
+        self.assertEqual(Disk.get_reserve_limit(), 2)
+
+    def test_limits_default_on_bad_settings(self):
+        SiteSettings.create(key='liba_borrow', value='many')
+        SiteSettings.create(key='liba_reserve', value='')
+        self.assertEqual(Disk.get_borrow_limit(), 2)
+        self.assertEqual(Disk.get_reserve_limit(), 2)
+
+    def test_limits_from_settings(self):
+        SiteSettings.create(key='liba_borrow', value='5')
+        SiteSettings.create(key='liba_reserve', value='1')
+        self.assertEqual(Disk.get_borrow_limit(), 5)
+        self.assertEqual(Disk.get_reserve_limit(), 1)
+
+    def test_acquire_slot_up_to_limit(self):
+        user = self.make_user('alice')
+        self.assertTrue(User.acquire_slot(user.id, 'borrowed_cnt', 2))
+        self.assertTrue(User.acquire_slot(user.id, 'borrowed_cnt', 2))
+        self.assertFalse(User.acquire_slot(user.id, 'borrowed_cnt', 2))
+        User.release_slot(user.id, 'borrowed_cnt')
+        self.assertEqual(User.get(User.id == user.id).borrowed_cnt, 1)
@@ -0,0 +1,61 @@
+import unittest
+from datetime import datetime
+
+from base import ClientTestCase
+from models import archive_years_between
+from frame_ext import merge_ordered
+
+
+class Row(object):
+    """Stands for a log of Log or of an archive"""
+    def __init__(self, id, created_at):
+        self._data = {'id': id, 'created_at': created_at}
+
+
+class ArchiveRangeTest(unittest.TestCase):
+    ordering = [('created_at', True), ('id', True)]
+
+    def test_years_of_range_across_years(self):
+        years = [2011, 2012, 2013]
+        self.assertEqual(
+            archive_years_between(
+                years, datetime(2011, 12, 1), datetime(2012, 2, 1)),
+            [2011, 2012])
+        self.assertEqual(
+            archive_years_between(years, None, datetime(2012, 2, 1)),
+            [2011, 2012])
+        self.assertEqual(
+            archive_years_between(years, datetime(2013, 5, 1), None),
+            [2013])
+        self.assertEqual(archive_years_between(years), years)
+
+    def test_merge_across_years(self):
+        # kept logs of 2011 stay in Log with the recent ones
+        hot = [Row(9, datetime(2014, 1, 1)), Row(3, datetime(2011, 12, 30))]
+        archive_2012 = [Row(6, datetime(2012, 1, 3)),
+                        Row(5, datetime(2012, 1, 1))]
+        archive_2011 = [Row(4, datetime(2011, 12, 31)),
+                        Row(2, datetime(2011, 12, 1))]
+        merged = merge_ordered(
+            [hot, archive_2012, archive_2011], self.ordering)
+        self.assertEqual([x._data['id'] for x in merged],
+                         [9, 6, 5, 4, 3, 2])
+
+    def test_merge_limit_and_ties(self):
+        same = datetime(2012, 1, 1)
+        merged = merge_ordered(
+            [[Row(2, same)], [Row(7, same), Row(1, same)]],
+            self.ordering, 2)
+        self.assertEqual([x._data['id'] for x in merged], [7, 2])
+
+
+class YearTest(ClientTestCase):
+    def test_year_out_of_range(self):
+        self.login(self.make_user('admin', admin=True))
+        for year in ['0', '99999', '9999']:
+            response = self.api('GET', '/api/log/?year=%s' % year)
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+from flask import g
+from werkzeug.datastructures import MultiDict
+from wtforms import Form
+from wtforms.validators import Optional
+
+from app import app, db
+from base import DatabaseTestCase
+from api import api
+from frame_ext import InstanceExist, FormIntegerField
+from models import Disk, User
+
+
+class CandidateForm(Form):
+    film_1 = FormIntegerField('film_1', [InstanceExist(Disk)])
+    film_2 = FormIntegerField('film_2', [InstanceExist(Disk)])
+    film_3 = FormIntegerField('film_3', [Optional(), InstanceExist(Disk)])
+    user = FormIntegerField('user', [InstanceExist(User)])
+
+
+class PrefetchTest(DatabaseTestCase):
+    def setUp(self):
+        super(PrefetchTest, self).setUp()
+        self.queries = []
+        execute_sql = db.database.execute_sql
+
+        def count_sql(sql, *args, **kwargs):
+            self.queries.append(sql)
+            return execute_sql(sql, *args, **kwargs)
+        db.database.execute_sql = count_sql
+        self.addCleanup(delattr, db.database, 'execute_sql')
+
+    def make_form(self, **data):
+        return CandidateForm(MultiDict(data))
+
+    def test_one_query_per_model(self):
+        disks = [self.make_disk(), self.make_disk()]
+        user = self.make_user('alice')
+        form = self.make_form(film_1=disks[0].id, film_2=disks[1].id,
+                              film_3=disks[0].id, user=user.id)
+        del self.queries[:]
+        found = InstanceExist.prefetch(form)
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual(found[(Disk, disks[1].id)].id, disks[1].id)
+        self.assertEqual(found[(User, user.id)].itsc, 'alice')
+
+        self.assertTrue(form.validate())
+        self.assertEqual(len(self.queries), 2)
+
+    def test_missing_instance_fails(self):
+        disk = self.make_disk()
+        form = self.make_form(film_1=disk.id, film_2=disk.id + 1,
+                              user=self.make_user('alice').id)
+        InstanceExist.prefetch(form)
+        del self.queries[:]
+        self.assertFalse(form.validate())
+        self.assertEqual(list(form.errors), ['film_2'])
+        self.assertEqual(self.queries, [])
+
+    def test_without_prefetch(self):
+        disk = self.make_disk()
+        form = self.make_form(film_1=disk.id, film_2=disk.id + 1,
+                              user=self.make_user('alice').id)
+        self.assertFalse(form.validate())
+        self.assertEqual(list(form.errors), ['film_2'])
+
+    def test_handler_reuses_instance(self):
+        user = self.make_user('alice')
+        resource = api._registry[Disk]
+        with app.test_request_context():
+            g.form_instances = {(User, user.id): user}
+            del self.queries[:]
+            self.assertIs(resource.get_instance(User, user.id), user)
+            self.assertEqual(self.queries, [])
+            other = self.make_user('bob')
+            self.assertEqual(resource.get_instance(User, other.id).itsc,
+                             'bob')
@@ -0,0 +1,44 @@
+from werkzeug.contrib.cache import SimpleCache
+
+from base import ClientTestCase
+from flask import json
+from cache_ext import object_cache, ObjectCache, CACHE_SCOPES
+from models import User
+
+
+class SessionUserTest(ClientTestCase):
+    def setUp(self):
+        super(SessionUserTest, self).setUp()
+        backend, object_cache.backend = object_cache.backend, SimpleCache()
+        self.addCleanup(setattr, object_cache, 'backend', backend)
+        self.user = self.make_user('alice')
+        self.login(self.user)
+
+    def current(self):
+        return json.loads(self.api('GET', '/api/user/current_user/').data)
+
+    def expire_elsewhere(self):
+        """Expire the member as another process does, which shares the
+        backend only
+        """
+        User.update(member_type='Expired').where(
+            User.id == self.user.id).execute()
+        other = ObjectCache(backend=object_cache.backend)
+        other.invalidate(User, self.user.id, CACHE_SCOPES)
+
+    def test_expired_elsewhere_logged_out_at_once(self):
+        self.assertEqual(self.current()['itsc'], 'alice')
+        self.expire_elsewhere()
+        self.assertEqual(self.current()['errno'], 2)
+
+    def test_expired_member_refused(self):
+        self.login(self.make_user('bob', member_type='Expired'))
+        self.assertEqual(self.current()['errno'], 2)
+        # refused again when read from the cache
+        self.assertEqual(self.current()['errno'], 2)
+
+    def test_expired_in_process_logged_out(self):
+        self.assertEqual(self.current()['itsc'], 'alice')
+        self.user.member_type = 'Expired'
+        self.user.save()
+        self.assertEqual(self.current()['errno'], 2)
@@ -0,0 +1,139 @@
+import ftplib
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from werkzeug.exceptions import NotFound
+
+from app import app
+from storage import Storage, FTPStorage, LocalStorage
+
+
+class FakeFTP(object):
+    """A connection to an FTP server kept in a dict of path -> content"""
+    def __init__(self, files):
+        self.files = files
+        self.broken = False
+        self.closed = False
+
+    def storbinary(self, command, file_handler, blocksize, callback=None):
+        if self.broken:
+            raise ftplib.error_temp('421 Timeout')
+        data = []
+        for block in iter(lambda: file_handler.read(blocksize), ''):
+            data.append(block)
+            if callback:
+                callback(block)
+        self.files[command[len('STOR '):]] = ''.join(data)
+
+    def voidcmd(self, command):
+        if self.broken:
+            raise ftplib.error_temp('421 Timeout')
+
+    def close(self):
+        self.closed = True
+
+    quit = close
+
+
+class FTPStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.files = {}
+        self.connections = []
+        self.storage = FTPStorage('ftp.test', 'user', 'password',
+                                  'http://ftp.test/', blocksize=4)
+
+        def connect():
+            conn = FakeFTP(self.files)
+            self.connections.append(conn)
+            return conn
+        self.storage._connect = connect
+
+    def test_store_reuses_connection(self):
+        progress = []
+        self.storage.store('a/b.txt', StringIO('0123456789'),
+                           progress.append)
+        self.storage.store('c.txt', StringIO('xyz'))
+        self.assertEqual(self.files, {'/a/b.txt': '0123456789',
+                                      '/c.txt': 'xyz'})
+        self.assertEqual(progress, [4, 8, 10])
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.storage.url('a/b.txt'),
+                         'http://ftp.test/a/b.txt')
+
+    def test_dropped_connection_retried(self):
+        self.storage.store('a.txt', StringIO('old'))
+        self.connections[0].broken = True
+        self.storage.store('a.txt', StringIO('new'))
+        self.assertEqual(self.files['/a.txt'], 'new')
+        self.assertEqual(len(self.connections), 2)
+        self.assertTrue(self.connections[0].closed)
+
+    def test_new_connection_failure_raised(self):
+        conn = FakeFTP(self.files)
+        conn.broken = True
+        self.storage._connect = lambda: conn
+        self.assertRaises(ftplib.error_temp, self.storage.store,
+                          'a.txt', StringIO('data'))
+
+    def test_idle_connection_checked(self):
+        self.storage.keepalive = 0
+        self.storage.store('a.txt', StringIO('a'))
+        self.connections[0].broken = True
+        self.storage.store('b.txt', StringIO('b'))
+        # the stale one fails NOOP and is dropped before the transfer
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.files['/b.txt'], 'b')
+
+    def test_close(self):
+        self.storage.store('a.txt', StringIO('a'))
+        self.storage.close()
+        self.assertTrue(self.connections[0].closed)
+
+
+class LocalStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = LocalStorage(self.root, '/storage/', blocksize=4)
+
+    def read(self, path):
+        with open(os.path.join(self.root, path), 'rb') as f:
+            return f.read()
+
+    def test_store_and_serve(self):
+        progress = []
+        self.storage.store('asset/upload/a.txt', StringIO('0123456789'),
+                           progress.append)
+        self.assertEqual(self.read('asset/upload/a.txt'), '0123456789')
+        self.assertEqual(progress, [4, 8, 10])
+        self.assertEqual(os.listdir(os.path.join(self.root, 'asset/upload')),
+                         ['a.txt'])
+        with app.test_request_context():
+            response = self.storage.serve('asset/upload/a.txt')
+            response.direct_passthrough = False
+            self.assertEqual(response.data, '0123456789')
+            self.assertRaises(NotFound, self.storage.serve, 'missing.txt')
+
+    def test_path_out_of_root(self):
+        self.assertRaises(IOError, self.storage.store,
+                          '../escape.txt', StringIO('x'))
+        with app.test_request_context():
+            self.assertRaises(NotFound, self.storage.serve, '../etc/passwd')
+
+    def test_failed_store_keeps_old_file(self):
+        self.storage.store('a.txt', StringIO('old'))
+
+        class Broken(object):
+            def read(self, size):
+                raise IOError("disconnected")
+        self.assertRaises(IOError, self.storage.store, 'a.txt', Broken())
+        self.assertEqual(self.read('a.txt'), 'old')
+        self.assertEqual(os.listdir(self.root), ['a.txt'])
+
+
+class StorageTest(unittest.TestCase):
+    def test_store_required(self):
+        self.assertRaises(TypeError, Storage, '/storage/')
@@ -0,0 +1,48 @@
+from base import DatabaseTestCase
+from models import Disk, DiskTag, DiskActor, TagFacet
+
+
+class TagIndexTest(DatabaseTestCase):
+    def tags_of(self, disk):
+        return sorted(x for x, in DiskTag.select(DiskTag.tag).where(
+            DiskTag.disk == disk.id).tuples())
+
+    def actors_of(self, disk):
+        return sorted(x for x, in DiskActor.select(DiskActor.actor).where(
+            DiskActor.disk == disk.id).tuples())
+
+    def facets(self):
+        return dict(TagFacet.select(TagFacet.tag, TagFacet.count).where(
+            TagFacet.count > 0).tuples())
+
+    def test_index_from_lists(self):
+        disk = self.make_disk(tags=['Drama', ' drama', 'Comedy', ''],
+                              actors=['Tony Leung'])
+        disk.sync_index()
+        self.assertEqual(self.tags_of(disk), ['Comedy', 'Drama'])
+        self.assertEqual(self.actors_of(disk), ['Tony Leung'])
+        self.assertEqual(self.facets(), {'Comedy': 1, 'Drama': 1})
+
+    def test_index_from_text(self):
+        disk = self.make_disk(tags='Drama, Comedy,drama',
+                              actors='Tony Leung, Maggie Cheung')
+        disk.sync_index()
+        self.assertEqual(self.tags_of(disk), ['Comedy', 'Drama'])
+        self.assertEqual(self.actors_of(disk),
+                         ['Maggie Cheung', 'Tony Leung'])
+
+    def test_text_assigned_on_save(self):
+        disk = self.make_disk(tags=['Drama'])
+        disk.sync_index()
+        disk = Disk.get(Disk.id == disk.id)
+        disk.tags = 'Action, Drama'
+        disk.save()
+        self.assertEqual(self.tags_of(disk), ['Action', 'Drama'])
+        self.assertEqual(self.facets(), {'Action': 1, 'Drama': 1})
+
+        disk = Disk.get(Disk.id == disk.id)
+        self.assertEqual(disk.tags, ['Action', 'Drama'])
+        disk.tags.remove('Drama')
+        disk.save()
+        self.assertEqual(self.tags_of(disk), ['Action'])
+        self.assertEqual(self.facets(), {'Action': 1})
@@ -0,0 +1,52 @@
+from base import ClientTestCase
+from flask import json
+from models import RegularFilmShow, Vote, Log
+
+
+class VoteTest(ClientTestCase):
+    def setUp(self):
+        super(VoteTest, self).setUp()
+        self.films = [self.make_disk() for x in range(3)]
+        self.show = RegularFilmShow.create(
+            state='Open', create_log=self.films[0].create_log,
+            film_1=self.films[0], film_2=self.films[1],
+            film_3=self.films[2])
+
+    def vote(self, user, film):
+        self.login(user)
+        return json.loads(self.api(
+            'POST', '/api/regularfilmshow/%d/vote/' % self.show.id,
+            {'film_id': film.id}).data)
+
+    def test_votes_make_tally_and_winner(self):
+        alice = self.make_user('alice')
+        bob = self.make_user('bob')
+        self.assertEqual(self.vote(alice, self.films[2])['errno'], 0)
+        self.assertEqual(self.vote(alice, self.films[1])['errno'], 0)
+        self.assertEqual(self.vote(bob, self.films[2])['errno'], 0)
+
+        self.assertEqual(self.show.get_tally(), {
+            self.films[0].id: 0, self.films[1].id: 1, self.films[2].id: 2})
+        self.assertEqual(self.show.to_show().id, self.films[2].id)
+        log = Log.select().where(
+            Log.log_type == 'vote').order_by(Log.id).get()
+        self.assertEqual(log.related_refer, self.films[2].id)
+
+    def test_votes_rejected(self):
+        alice = self.make_user('alice')
+        self.vote(alice, self.films[0])
+        self.assertEqual(self.vote(alice, self.films[0])['error'],
+                         "You have voted before")
+        self.vote(alice, self.films[1])
+        self.assertEqual(self.vote(alice, self.films[2])['error'],
+                         "A member can vote at most twice")
+        # a disk which is not a candidate
+        self.assertEqual(
+            self.vote(self.make_user('bob'), self.make_disk())['error'],
+            "Invalid Choice")
+        self.assertEqual(Vote.select().count(), 2)
+
+    def test_tie_goes_to_earlier_candidate(self):
+        self.vote(self.make_user('alice'), self.films[1])
+        self.vote(self.make_user('bob'), self.films[0])
+        self.assertEqual(self.show.to_show().id, self.films[0].id)
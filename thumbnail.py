@@ -0,0 +1,178 @@
+import atexit
+import traceback
+from cStringIO import StringIO
+
+# PIL is optional, uploads simply get no variants without it
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from app import app, db
+from models import File, Log
+from storage import storage, UPLOAD_DIR
+from cache_ext import model_changed
+
+__all__ = [
+    'IMAGE_EXTENSIONS',
+    'make_variants',
+    'wants_variants',
+    'start_pool',
+    'submit_variants',
+]
+
+# extensions of uploads to make variants of
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
+
+# name -> (width, height) the variant is fit within
+SIZES = app.config.get('THUMBNAIL_SIZES', {
+    'thumb': (200, 300),
+    'medium': (480, 720),
+})
+
+# JPEG quality of the variants
+QUALITY = app.config.get('THUMBNAIL_QUALITY', 80)
+
+# the pool of worker processes, None if variants are made in requests
+_pool = None
+
+
+def make_variants(filename, data):
+    """Return a dict of size name -> (file name, JPEG data) of the
+    variants of an image. Run in the worker processes.
+
+    Variants no smaller than the original are left out.
+
+    :param filename:
+        The name the original is stored as
+    :param data:
+        The content of the original
+    """
+    base = filename.rsplit('.', 1)[0]
+    image = Image.open(StringIO(data))
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    result = {}
+    for name, size in SIZES.items():
+        if image.size[0] <= size[0] and image.size[1] <= size[1]:
+            continue
+        variant = image.copy()
+        variant.thumbnail(size, Image.ANTIALIAS)
+        output = StringIO()
+        variant.save(output, 'JPEG', quality=QUALITY, optimize=True)
+        result[name] = ('%s_%s.jpg' % (base, name), output.getvalue())
+    return result
+
+
+def make_variants_safely(filename, data):
+    """Run make_variants in a worker process. Return (variants, None),
+    or (None, the traceback) if failed, as an exception raised in a
+    worker never reaches the callback.
+    """
+    try:
+        return make_variants(filename, data), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def record_variants(file_id, variants):
+    """Store the variants made and record them against the file. A log
+    is left, which moves the versions of the resources showing files.
+
+    :param file_id:
+        The ID of the file
+    :param variants:
+        The result of make_variants
+    """
+    recorded = {}
+    for name, (filename, data) in variants.items():
+        try:
+            storage.store(UPLOAD_DIR + filename, StringIO(data))
+        except Exception:
+            app.logger.exception('Failed to store variant %s', filename)
+            continue
+        recorded[name] = filename
+    if recorded:
+        File.update(variants=recorded).where(File.id == file_id).execute()
+        Log.create(model='File', model_refer=file_id, log_type='edit',
+                   sub_type='variants',
+                   content="make variants %s of file %d" %
+                        (', '.join(sorted(recorded)), file_id))
+        model_changed(File, file_id)
+
+
+def start_pool():
+    """Create the pool of THUMBNAIL_WORKERS worker processes. Call it at
+    startup before the database is connected, so that the workers are
+    not forked with the connection or the threads of the website.
+
+    The variants made are recorded by the result thread of the pool,
+    which opens a connection of its own, so DATABASE must set
+    threadlocals. Otherwise no pool is created and the variants are
+    made in the request.
+    """
+    global _pool
+    workers = app.config.get('THUMBNAIL_WORKERS', 2)
+    if _pool is not None or not workers or Image is None:
+        return
+    if not app.config['DATABASE'].get('threadlocals'):
+        app.logger.warning('THUMBNAIL_WORKERS needs threadlocals in '
+                           'DATABASE, variants are made in requests')
+        return
+    import multiprocessing
+    _pool = multiprocessing.Pool(workers)
+    atexit.register(_pool.terminate)
+
+
+def wants_variants(filename):
+    """Return whether variants are made of an upload stored as filename,
+    so that its content is only read into memory if needed
+    """
+    if Image is None:
+        return False
+    ext = ('.' + filename.rsplit('.', 1)[1].lower()
+            if '.' in filename else '')
+    return ext in IMAGE_EXTENSIONS
+
+
+def submit_variants(instance, data):
+    """Make the variants of an uploaded image in the background
+
+    The request does not wait for them. The variants are recorded in
+    File.variants once made. Without the pool of start_pool() they are
+    made in the calling thread instead.
+
+    :param instance:
+        The File of the upload
+    :param data:
+        The content of the upload
+    """
+    if not wants_variants(instance.url):
+        return
+
+    file_id = instance.id
+    if _pool is None:
+        try:
+            record_variants(file_id, make_variants(instance.url, data))
+        except Exception:
+            app.logger.exception('Failed to make variants of %d', file_id)
+        return
+
+    def callback(result):
+        # in the result thread of the pool, which connects to the
+        # database the way a request does
+        variants, error = result
+        if error is not None:
+            app.logger.error('Failed to make variants of %d:\n%s',
+                             file_id, error)
+            return
+        try:
+            db.connect_db()
+            record_variants(file_id, variants)
+        except Exception:
+            app.logger.exception('Failed to record variants of %d', file_id)
+        finally:
+            db.close_db(None)
+
+    _pool.apply_async(make_variants_safely, (instance.url, data),
+                            callback=callback)